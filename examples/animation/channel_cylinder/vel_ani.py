@@ -55,46 +55,21 @@ y_formatter = mtick.ScalarFormatter(useOffset=False)
 ## -------------------------------------------------------------------------- ##
 logging.basicConfig(level=logging.INFO)
 ## -------------------------------------------------------------------------- ##
-import glob
-import re
-from operator import itemgetter
-
 # enter the file names of the tracking files here
-resfiles = glob.glob('tracking/*vel_global_p*.res')
+resfiles = 'tracking/*vel_global_p*.res'
 
 # data base filename
 dbname = 'vel_ani.db'
 nFrames = 100
-if os.path.isfile(dbname):
-  print ('Processing data from database file: '+dbname)
-  import sqlite3
-  sqlcon = sqlite3.connect(dbname)
-else:
-  print ('Processing data from tracking files')
-  
-  ftimes = []
-  for rf in resfiles:
-    # Name of resulting files
-    # searching for a match
-    m = re.search('tracking/.*_t(?P<time>.*).res', rf)
-    #print('m: ',m)
-    timestr = rf.split('_')[-1]
-    #print('timestr: ',timestr)
-    #print("float(m.group('time')): ",m.group('time'))
-    ftimes.append((float(m.group('time')), timestr, rf))
-  
-  # files are sorted from first to last time step
-  sortfiles = sorted(ftimes, key=itemgetter(0))
-  #print('sortfiles: ',sortfiles)
-  
-  #for itime in range(len(sortfiles)):
-  interval = len(sortfiles)/nFrames
-  for itime in range(nFrames):
-    timestr = sortfiles[int(itime*interval)][1] 
-    print(itime, itime*interval, timestr)
-    # Load text, dump into a database with specific tabname to get columns later
-    sqlcon = gleaner.tracking_to_db(fname = ['tracking/*vel_global_p*'+timestr], \
-                                    dbname=dbname, tabname='vel_vec'+str(itime))
+print ('Processing data from tracking files')
+# All time steps are stored in the single table vel_vec with their time,
+# files that are already in the database are skipped.
+sqlcon = gleaner.tracking_series_to_db(fname = resfiles, dbname = dbname,
+                                       tabname = 'vel_vec')
+
+# time steps sorted from first to last
+times = gleaner.tracking_times(sqlcon, 'vel_vec')
+interval = len(times)/nFrames
 # -------------------------------------------------------------------------- ##
 from matplotlib import animation
 if use_gif == False:
@@ -148,8 +123,10 @@ mplt.tight_layout()
 # function for animation
 def animate(i):
   # read columns from data base and store them as lists
-  [x, y, u, v] = gleaner.get_columns(sqlcon, tabname='vel_vec'+str(i), \
-                               columns=get_data_for_cols)
+  [x, y, u, v] = gleaner.tracking_frame(sqlcon, tabname='vel_vec',
+                                        time=times[int(i*interval)],
+                                        columns=get_data_for_cols,
+                                        order_by='coordX, coordY')
   # calculate the norm of the velocity vector for the arrow plots
   u = tuple((m*0.04,) for m in u)
   v = tuple((n*0.04,) for n in v)
@@ -158,7 +135,6 @@ def animate(i):
   sum_uv = tuple(map(operator.add, u, v))
   # calculate the arrows' color 
   c = tuple(l[0]**0.5 for l in sum_uv)
-  x, y, u, v, c = zip(*sorted(zip(x,y,u,v,c))) # sort of needed
   # Make vector plot as subplot
   ax.quiver(x, y, u, v, c, cmap='jet', linewidth=0.3)
   ax.title.set_text('Velocity plot\ntime step = '+str(i))
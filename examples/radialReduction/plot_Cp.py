@@ -38,24 +38,16 @@ fieldnames = ['coeffPressure']
 gleaner.radial_reduction_in_db(sqlcon, tabname='Cp',
                                columns=fieldnames,
                                coord_column=coord_col,
-                               geometry_pos = [cylinder_x, cylinder_y])
+                               geometry_pos = [cylinder_x, cylinder_y],
+                               resolution = 1.0)
 ## -------------------------------------------------------------------------- ##
 logging.info('Pressure coefficient on the cylinder:')
 fig = mplt.figure()
 ax = fig.add_subplot(111)
-interval = 2
 get_data_for_cols = ['theta', 'coeffPressure']
-[theta, Cp_avg] = gleaner.get_columns(sqlcon, tabname='Cp_red', \
-                                      columns=get_data_for_cols)
-
-nPoints = len(theta) / interval
-theta_new = []
-Cp_avg_new = []
-for ii in range(0, len(theta), interval):
-  theta_new.append(theta[ii])
-  Cp_avg_new.append(Cp_avg[ii])
-
-theta_new, Cp_avg_new = zip(*sorted(zip(theta_new, Cp_avg_new)))
+[theta_new, Cp_avg_new] = gleaner.get_columns(sqlcon, tabname='Cp_red', \
+                                              columns=get_data_for_cols,
+                                              order_by='theta')
 
 logging.info('base pressure coefficient: ' + str(np.max(Cp_avg_new)))
 mplt.plot(theta_new, Cp_avg_new, 'o', color='k')
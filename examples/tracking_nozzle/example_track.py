@@ -72,8 +72,7 @@ ax = fig.add_subplot(111)
 # Simulation result
 get_data_for_cols = ['coordX','normalized_pressure']
 [x, y] = gleaner.get_columns(sqlcon, tabname='hline', \
-                             columns=get_data_for_cols)
-x, y = zip(*sorted(zip(x,y))) # sort of needed
+                             columns=get_data_for_cols, order_by='coordX')
 mplt.plot(x, y, '-', color = 'r', label = 'Pressure')
 
 mplt.axvline(x=nozzle_inner_dia_X, ls='-', color = 'b', label = 'x='+str(nozzle_inner_dia_X))
@@ -100,8 +99,7 @@ ax = fig.add_subplot(111)
 # Simulation result
 get_data_for_cols = ['coordX','velocity_phy_01']
 [x, y] = gleaner.get_columns(sqlcon, tabname='hline', \
-                             columns=get_data_for_cols)
-x, y = zip(*sorted(zip(x,y))) # sort of needed
+                             columns=get_data_for_cols, order_by='coordX')
 mplt.plot(x, y, '-', color = 'r', label = 'Velocity X')
 
 mplt.axvline(x=nozzle_inner_dia_X, ls='-', color = 'b', label = 'x='+str(nozzle_inner_dia_X))
@@ -128,8 +126,7 @@ ax = fig.add_subplot(111)
 # Simulation result
 get_data_for_cols = ['coordX','velocity_phy_02']
 [x, y] = gleaner.get_columns(sqlcon, tabname='hline', \
-                             columns=get_data_for_cols)
-x, y = zip(*sorted(zip(x,y))) # sort of needed
+                             columns=get_data_for_cols, order_by='coordX')
 mplt.plot(x, y, '-', color = 'r', label = 'Velocity Y')
 
 mplt.axvline(x=nozzle_inner_dia_X, ls='-', color = 'b', label = 'x='+str(nozzle_inner_dia_X))
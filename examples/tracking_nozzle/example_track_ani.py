@@ -36,41 +36,21 @@ nozzle_inner_dia_X = float(Popen(['lua', '-e',"dofile '"+simfile+"'; \
 ## -------------------------------------------------------------------------- ##
 logging.info('Started creating plots ...') 
  
-import glob
-import re
-from operator import itemgetter
-resfiles = glob.glob('tracking/*hline_p00000_*.res')
+# enter the file names of the tracking files here
+resfiles = 'tracking/*hline_p*.res'
 
 # data base filename
 dbname = 'track_ani.db'
 nFrames = 100
-if os.path.isfile(dbname):
-  print ('Processing data from database file: '+dbname)
-#  os.remove(dbname)
-  import sqlite3
-  sqlcon = sqlite3.connect(dbname)
-else:
-  print ('Processing data from tracking files')
-
-  ftimes = []
-  for rf in resfiles:
-    m = re.search('tracking/.*hline_p00000_t(?P<time>.*).res', rf)
-    print('m: ',m)
-    timestr = rf.split('_')[-1]
-    ftimes.append((float(m.group('time')), timestr, rf))
-
-  sortfiles = sorted(ftimes, key=itemgetter(0))
-  #last_ftime = sortfiles[-1][1].split('_')[-1]
-  #print ('Processing time file: *'+last_ftime)
-
-  #for itime in range(len(sortfiles)):
-  interval = len(sortfiles)/nFrames
-  for itime in range(nFrames):
-    timestr = sortfiles[int(itime*interval)][1] 
-    print(itime, itime*interval, timestr)
-    # Load text, dump into a database with specific tabname to get columns later
-    sqlcon = gleaner.tracking_to_db(fname = ['tracking/*hline_p*'+timestr], \
-                                    dbname=dbname, tabname='hline'+str(itime))
+print ('Processing data from tracking files')
+# All time steps are stored in the single table hline with their time,
+# files that are already in the database are skipped.
+sqlcon = gleaner.tracking_series_to_db(fname = resfiles, dbname = dbname,
+                                       tabname = 'hline')
+
+# time steps sorted from first to last
+times = gleaner.tracking_times(sqlcon, 'hline')
+interval = len(times)/nFrames
 # -------------------------------------------------------------------------- ##
 # Animation for all time steps
 logging.info('Started creating animation ...')
@@ -100,9 +80,10 @@ if funcAnimation == True:
     return line
 
   def animate(i):
-    [x, y] = gleaner.get_columns(sqlcon, tabname='hline'+str(i), \
-                                 columns=get_data_for_cols)
-    x, y = zip(*sorted(zip(x,y))) # sort of needed
+    [x, y] = gleaner.tracking_frame(sqlcon, tabname='hline',
+                                    time=times[int(i*interval)],
+                                    columns=get_data_for_cols,
+                                    order_by='coordX')
     line.set_data(x,y)
     if i >= (nFrames/2):
       ax.set_ylim(-0.25,0.25)
@@ -118,9 +99,10 @@ if funcAnimation == True:
 else:
   hline = []
   for iplt in range(nFrames):
-    [x, y] = gleaner.get_columns(sqlcon, tabname='hline'+str(iplt), \
-                                 columns=get_data_for_cols)
-    x, y = zip(*sorted(zip(x,y))) # sort of needed
+    [x, y] = gleaner.tracking_frame(sqlcon, tabname='hline',
+                                    time=times[int(iplt*interval)],
+                                    columns=get_data_for_cols,
+                                    order_by='coordX')
     if iplt == 0:
       hline.append(mplt.plot(x, y, '-', color = 'r', label = 'Pressure'))
     else:
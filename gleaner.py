@@ -37,8 +37,24 @@ OF THIS SOFTWARE, EVEN IF ADVISED OF THE POSSIBILITY OF SUCH DAMAGE.
 import sys
 import logging
 import re
+from collections import OrderedDict
+from contextlib import contextmanager
+from functools import lru_cache, wraps
 from pathlib import Path
 
+# Number of rows to parse and hand over to SQLite in one executemany call.
+BULK_BATCHSIZE = 50000
+
+# Number of rows after which a bulk insertion is committed, so readers on
+# other connections can follow the progress.
+BULK_COMMIT_ROWS = 500000
+
+# Seconds to wait for locks held by other connections to the database.
+BUSY_TIMEOUT = 30.0
+
+# Number of rows in each array yielded by column_chunks.
+STREAM_CHUNKSIZE = 65536
+
 def first_word_of(string):
   ''' (string) -> string
       Get only the first word in a string and strip off all characters that are
@@ -57,6 +73,380 @@ def untyped_colstring(columns):
   return ', '.join(names)
 
 
+def insert_query(tabname, columns):
+  ''' (string, array of strings) -> string
+      Create the INSERT statement with placeholders for all 'columns' of the
+      table 'tabname'. The same statement can then be reused for all rows.
+  '''
+  col_titles = [first_word_of(col) for col in columns]
+  return 'INSERT INTO {0} ({1}) VALUES ({2});'.format(
+             tabname,
+             ', '.join(col_titles),
+             ', '.join('?'*len(col_titles)) )
+
+
+def connect(dbname, readonly=False, timeout=BUSY_TIMEOUT):
+  ''' (string, bool, float) -> sqlite3.Connection
+      Open a connection to the database file 'dbname'.
+      The database is put into write-ahead logging mode, so readers on other
+      connections are not blocked by an ongoing ingestion and vice versa.
+      Connections wait up to 'timeout' seconds for locks held by others,
+      before failing with 'database is locked'.
+      With 'readonly' the database is opened via a read-only URI, for example
+      for plotting scripts running alongside an ingestion. It then has to
+      exist already.
+  '''
+  import sqlite3
+
+  if readonly:
+    uri = Path(dbname).resolve().as_uri() + '?mode=ro'
+    return sqlite3.connect(uri, uri=True, timeout=timeout)
+
+  sqlcon = sqlite3.connect(dbname, timeout=timeout)
+  sqlcon.execute('PRAGMA journal_mode = WAL')
+  return sqlcon
+
+
+# Callbacks around the commits of the connections inside a bulk_load context,
+# by the id of the connection.
+bulk_loading = {}
+
+@contextmanager
+def bulk_load(sqlcon, on_commit=None, on_begin=None):
+  ''' (sqlite3.Connection, fun(sqlite3.Connection), fun(sqlite3.Connection))
+      Context to run a bulk insertion into the database connected by 'sqlcon'.
+      Durability guarantees are relaxed for the duration of the context and
+      a larger page cache as well as temporary storage in memory are used.
+      The previous settings of all three are restored afterwards.
+      The transaction is begun right away, so no other connection writes in
+      between. All insertions within the context are committed on exit, and
+      by bulk_commit in between.
+      Nested contexts on the same connection join the outermost one, which
+      alone commits on exit.
+      'on_commit' is called right before each commit by bulk_commit, and
+      'on_begin' right after the next transaction has begun, as long as the
+      context is active. They are not called on the exit of the context.
+  '''
+  nested = id(sqlcon) in bulk_loading
+  if not nested:
+    settings = { pragma: sqlcon.execute('PRAGMA ' + pragma).fetchone()[0]
+                 for pragma in ('synchronous', 'cache_size', 'temp_store') }
+    sqlcon.execute('PRAGMA synchronous = OFF')
+    sqlcon.execute('PRAGMA cache_size = -65536')
+    sqlcon.execute('PRAGMA temp_store = MEMORY')
+    bulk_loading[id(sqlcon)] = []
+
+  callbacks = bulk_loading[id(sqlcon)]
+  callback = (on_commit, on_begin)
+  callbacks.append(callback)
+  try:
+    if not nested and not sqlcon.in_transaction:
+      sqlcon.execute('BEGIN IMMEDIATE')
+    yield sqlcon
+    if not nested:
+      sqlcon.commit()
+  finally:
+    callbacks.remove(callback)
+    if not nested:
+      del bulk_loading[id(sqlcon)]
+      if sqlcon.in_transaction:
+        sqlcon.rollback()
+      for pragma, value in settings.items():
+        sqlcon.execute('PRAGMA {0} = {1:d}'.format(pragma, value))
+
+
+def bulk_commit(sqlcon):
+  ''' (sqlite3.Connection)
+      Commit the insertions so far on 'sqlcon', so other connections can see
+      them. Inside a bulk_load context the next transaction is begun right
+      away and the callbacks of all active contexts are run around the
+      commit.
+  '''
+  callbacks = bulk_loading.get(id(sqlcon))
+  if callbacks is None:
+    sqlcon.commit()
+    return
+
+  for on_commit, on_begin in callbacks:
+    if on_commit is not None:
+      on_commit(sqlcon)
+  sqlcon.commit()
+  sqlcon.execute('BEGIN IMMEDIATE')
+  for on_commit, on_begin in callbacks:
+    if on_begin is not None:
+      on_begin(sqlcon)
+
+
+def split_rows(datfile, delimiter=' '):
+  ''' (file object, string) -> iterable of arrays
+      Split the lines in 'datfile' into their fields.
+      Plain whitespace separated data, as written by the APES tools, is split
+      by str.split, all other delimiters are handled by the csv module.
+  '''
+  if delimiter == ' ':
+    return (line.split() for line in datfile)
+
+  import csv
+  return csv.reader(datfile, delimiter=delimiter, skipinitialspace=True)
+
+
+def fitted_rows(rows, ncols):
+  ''' (iterable of arrays, integer) -> generator of arrays
+      Bring all 'rows' to exactly 'ncols' entries, missing fields are filled
+      with None and surplus fields are dropped. Empty rows are skipped.
+  '''
+  for row in rows:
+    if len(row) == ncols:
+      yield row
+    elif row:
+      yield (row + [None]*ncols)[:ncols]
+
+
+# Leading bytes of compressed files.
+COMPRESSION_MAGIC = { b'\x1f\x8b': 'gzip',
+                      b'BZh': 'bz2',
+                      b'\xfd7zXZ\x00': 'xz',
+                      b'\x28\xb5\x2f\xfd': 'zstd' }
+
+def compression_of(filename):
+  ''' (string) -> string or None
+      Detect the compression of the file 'filename' by its leading bytes.
+      Returned is one of 'gzip', 'bz2', 'xz' or 'zstd', or None for
+      uncompressed files.
+  '''
+  with open(filename, 'rb') as datfile:
+    lead = datfile.read(6)
+  for magic, kind in COMPRESSION_MAGIC.items():
+    if lead.startswith(magic):
+      return kind
+  return None
+
+
+def open_data(filename):
+  ''' (string) -> binary file object
+      Open the file 'filename' for reading, compressed files are decompressed
+      transparently while reading.
+      Reading zstd compressed files requires the zstandard package.
+  '''
+  kind = compression_of(filename)
+  if kind is None:
+    return open(filename, 'rb')
+  if kind == 'gzip':
+    import gzip
+    return gzip.open(filename, 'rb')
+  if kind == 'bz2':
+    import bz2
+    return bz2.open(filename, 'rb')
+  if kind == 'xz':
+    import lzma
+    return lzma.open(filename, 'rb')
+
+  try:
+    import zstandard
+  except ImportError:
+    raise ImportError( 'The zstandard package is needed to read the zstd'
+                       ' compressed file ' + str(filename) )
+  return zstandard.ZstdDecompressor().stream_reader( open(filename, 'rb'),
+                                                     read_across_frames=True )
+
+
+def open_text(filename):
+  ''' (string) -> text file object
+      Open the file 'filename' for reading text, compressed files are
+      decompressed transparently.
+  '''
+  import io
+
+  if compression_of(filename) is None:
+    return open(filename, 'r')
+  return io.TextIOWrapper(open_data(filename))
+
+
+def background_chunks(datfile, chunksize=1 << 20, depth=4):
+  ''' (binary file object, integer, integer) -> generator of bytes
+      Read 'datfile' in chunks of 'chunksize' bytes in a background thread,
+      which stays up to 'depth' chunks ahead of the consumer.
+      This allows the decompression of data to overlap with its processing.
+  '''
+  import queue
+  import threading
+
+  chunks = queue.Queue(maxsize=depth)
+  stop = threading.Event()
+
+  def hand_over(item):
+    while not stop.is_set():
+      try:
+        chunks.put(item, timeout=0.1)
+        return
+      except queue.Full:
+        pass
+
+  def produce():
+    try:
+      chunk = datfile.read(chunksize)
+      while chunk:
+        hand_over(chunk)
+        chunk = datfile.read(chunksize)
+      hand_over(b'')
+    except Exception as err:
+      hand_over(err)
+
+  reader = threading.Thread(target=produce, daemon=True)
+  reader.start()
+  try:
+    while True:
+      chunk = chunks.get()
+      if isinstance(chunk, Exception):
+        raise chunk
+      if not chunk:
+        break
+      yield chunk
+  finally:
+    stop.set()
+    reader.join()
+
+
+def read_lines(filename, offset=0, end=None):
+  ''' (string, integer, integer) -> generator of strings
+      Read the lines of the file 'filename' starting at byte position 'offset'
+      and stopping at byte position 'end' (defaults to the end of the file).
+      Only lines that fit completely into this range are returned.
+
+      Compressed files are decompressed in a background thread while the
+      lines are consumed. They can only be read as a whole, 'offset' has to
+      be 0 for them and 'end' is ignored.
+  '''
+  if compression_of(filename) is not None:
+    if offset != 0:
+      raise ValueError( 'Compressed files can only be read from their start: '
+                        + str(filename) )
+    with open_data(filename) as datfile:
+      rest = b''
+      for chunk in background_chunks(datfile):
+        lines = (rest + chunk).split(b'\n')
+        rest = lines.pop()
+        for line in lines:
+          yield line.decode() + '\n'
+      if rest:
+        yield rest.decode()
+    return
+
+  with open(filename, 'rb') as datfile:
+    datfile.seek(offset)
+    remaining = end - offset if end is not None else None
+    for line in datfile:
+      if remaining is not None:
+        remaining -= len(line)
+        if remaining < 0:
+          break
+      yield line.decode()
+
+
+def load_numeric_array(filename, skiprows=0, offset=0, end=None, usecols=None):
+  ''' (string, integer, integer, integer, array of integers) -> numpy.ndarray
+      Read the whitespace separated numbers in 'filename' into a 2-D float64
+      array with one row per line, in one pass of the compiled NumPy parser,
+      which reads directly from the (decompressed) file.
+      Fortran formatted reals like -0.1900000000000000E+000 are understood.
+      The first 'skiprows' lines are skipped, and lines starting with a '#'
+      are ignored.
+      Only the part of the file from byte 'offset' up to byte 'end' is read,
+      by default the complete file. Like in read_lines, compressed files can
+      only be read as a whole.
+      'usecols' may select a subset of the columns by their indices.
+  '''
+  import io
+  import warnings
+  import numpy as np
+
+  if offset != 0 and compression_of(filename) is not None:
+    raise ValueError( 'Compressed files can only be read from their start: '
+                      + str(filename) )
+
+  def parse(source):
+    with warnings.catch_warnings():
+      # A file without data lines just results in an empty array.
+      warnings.filterwarnings('ignore', message='.*input contained no data')
+      return np.loadtxt( source, dtype=np.float64, skiprows=skiprows,
+                         usecols=usecols, ndmin=2 )
+
+  if compression_of(filename) is None and offset == 0 and end is None:
+    # NumPy reads a plain file fastest when it opens the file itself.
+    return parse(filename)
+  with open_data(filename) as datfile:
+    if offset:
+      datfile.seek(offset)
+    if end is not None and compression_of(filename) is None:
+      return parse(io.BytesIO(datfile.read(end - offset)))
+    return parse(datfile)
+
+
+################################ SCHEMA REGISTRY ###############################
+# Number of database files for which the column names of tables are kept.
+SCHEMA_REGISTRY_SIZE = 16
+
+# Column names of tables in recently used database files, see table_columns.
+schema_registry = OrderedDict()
+
+def schema_of(sqlcon):
+  ''' (sqlite3.Connection) -> dict or None
+      Get the entry of the database connected by 'sqlcon' in the schema
+      registry. It holds the known column names for tables in 'tables' and
+      the schema version of the database they are valid for in 'version'.
+      Entries are kept by the name of the database file, so they are shared
+      by all connections to it and do not keep any connection alive. When
+      the schema of the database changed, the entry is emptied.
+      Databases in memory have no name to be found by, for them None is
+      returned and nothing is kept.
+  '''
+  dbfile = database_file(sqlcon)
+  if not dbfile:
+    return None
+  version = sqlcon.execute('PRAGMA schema_version').fetchone()[0]
+  entry = schema_registry.get(dbfile)
+  if entry is None or entry['version'] != version:
+    entry = {'version': version, 'tables': {}}
+    schema_registry[dbfile] = entry
+    if len(schema_registry) > SCHEMA_REGISTRY_SIZE:
+      schema_registry.popitem(last=False)
+  schema_registry.move_to_end(dbfile)
+  return entry
+
+
+def table_columns(sqlcon, tabname):
+  ''' (sqlite3.Connection, string) -> array of strings
+      Get the names of all columns in the table 'tabname', an empty list if
+      the table does not exist.
+      The names are obtained by PRAGMA table_info and kept in the schema
+      registry until the schema of the database changes.
+  '''
+  entry = schema_of(sqlcon)
+  if entry is None:
+    return [ row[1] for row in
+             sqlcon.execute('PRAGMA table_info({0})'.format(tabname)) ]
+  tables = entry['tables']
+  if tabname not in tables:
+    tables[tabname] = [ row[1] for row in
+                        sqlcon.execute('PRAGMA table_info({0})'.format(tabname)) ]
+  return list(tables[tabname])
+
+
+def register_columns(sqlcon, tabname, columns):
+  ''' (sqlite3.Connection, string, array of strings)
+      Update the schema registry after the columns of the table 'tabname'
+      were changed to 'columns' by this connection. The other tables of the
+      database are dropped from the registry, as other connections may have
+      changed them in the meantime.
+  '''
+  dbfile = database_file(sqlcon)
+  entry = schema_registry.get(dbfile) if dbfile else None
+  if entry is None:
+    return
+  entry['version'] = sqlcon.execute('PRAGMA schema_version').fetchone()[0]
+  entry['tables'] = {tabname: list(columns)}
+########################### END   schema registry ##############################
+
 
 def expand_table(sqlcon, tabname, columns, col_to_string=untyped_colstring):
   """ (sqlite3.Connection, string, array of strings,
@@ -72,32 +462,458 @@ def expand_table(sqlcon, tabname, columns, col_to_string=untyped_colstring):
       col_to_string is expected to provide a method to turn the list of
       column names into an SQL expression to add columns.
       This can be used to add data types to the columns.
+
+      The existing columns are looked up in the schema registry, see
+      table_columns.
+      The changes are committed right away, except inside a bulk_load
+      context, whose transaction they join.
   """
 
   column_titles = []
   for col in columns:
     column_titles.append(first_word_of(col))
 
-  cols_string = col_to_string(column_titles)
-  create_string = 'CREATE TABLE IF NOT EXISTS {0} ({1})'.format(tabname,
-                                                                cols_string)
-  sqlcon.execute(create_string)
-  sqlcursor = sqlcon.execute('SELECT * FROM ' + tabname)
-  colnames = list(map(lambda x: x[0], sqlcursor.description))
+  colnames = table_columns(sqlcon, tabname)
+  if not colnames:
+    cols_string = col_to_string(column_titles)
+    create_string = 'CREATE TABLE IF NOT EXISTS {0} ({1})'.format(tabname,
+                                                                  cols_string)
+    sqlcon.execute(create_string)
+    colnames = [ row[1] for row in
+                 sqlcon.execute('PRAGMA table_info({0})'.format(tabname)) ]
+    register_columns(sqlcon, tabname, colnames)
+
   newcols = [name for name in column_titles if name not in colnames]
   for nc in newcols:
-    nc_qmarks = col_to_string(nc)
+    nc_qmarks = col_to_string([nc])
     alter_string = 'ALTER TABLE {0} ADD COLUMN {1}'.format(tabname, nc_qmarks)
     sqlcon.execute( alter_string )
+  if newcols:
+    colnames = colnames + newcols
+    register_columns(sqlcon, tabname, colnames)
+  if id(sqlcon) not in bulk_loading:
+    sqlcon.commit()
+
+  return colnames
+
+
+def table_exists(sqlcon, tabname):
+  ''' (sqlite3.Connection, string) -> bool
+      Check whether the table 'tabname' exists in the database.
+  '''
+  cur = sqlcon.execute( "SELECT count(name) FROM sqlite_master"
+                        " WHERE type='table' AND name=?", (tabname,) )
+  return cur.fetchone()[0] == 1
+
+
+# Name of the table that counts modifications of tables by gleaner.
+# Its row for its own name holds a random token identifying the database.
+VERSIONS_TABLE = 'gleaner_table_versions'
+
+def create_versions_table(sqlcon):
+  ''' (sqlite3.Connection)
+      Create the table of modification counts, if it does not exist yet, along
+      with the token of the database, see database_token.
+      The change is part of the current transaction and not committed.
+  '''
+  import secrets
+
+  sqlcon.execute( 'CREATE TABLE IF NOT EXISTS {0}'
+                  ' (tabname TEXT PRIMARY KEY, version INTEGER)'
+                  .format(VERSIONS_TABLE) )
+  sqlcon.execute( 'INSERT OR IGNORE INTO {0} (tabname, version) VALUES (?, ?)'
+                  .format(VERSIONS_TABLE),
+                  (VERSIONS_TABLE, secrets.randbits(62)) )
+
+
+def database_token(sqlcon):
+  ''' (sqlite3.Connection) -> integer or None
+      Get the random token that was stored in the database along with the
+      table of modification counts. It tells apart databases that replaced
+      each other under the same name, for example after deleting and
+      rebuilding a database. None if the database has no token yet.
+  '''
+  return table_version(sqlcon, VERSIONS_TABLE) or None
+
+
+def touch_table(sqlcon, tabname):
+  ''' (sqlite3.Connection, string)
+      Count a modification of the table 'tabname'. This is used to invalidate
+      data derived from the table, like cached columns.
+      The change is part of the current transaction and not committed.
+  '''
+  create_versions_table(sqlcon)
+  sqlcon.execute( 'INSERT INTO {0} (tabname, version) VALUES (?, 1)'
+                  ' ON CONFLICT(tabname) DO UPDATE SET version = version + 1'
+                  .format(VERSIONS_TABLE), (tabname,) )
+
+
+def watch_table(sqlcon, tabname):
+  ''' (sqlite3.Connection, string) -> bool
+      Make sure that updates and deletions of rows in the table 'tabname' are
+      counted like the modifications by touch_table, also when they are done
+      by other programs. This is done by triggers on the table, which are
+      created once and dropped along with the table.
+      Insertions are not counted, as a trigger would run for each inserted
+      row. Rows appended by other programs show up in the largest rowid.
+      Returned is whether the table is watched, read-only connections can
+      not create the triggers.
+  '''
+  import sqlite3
+
+  names = [ 'gleaner_{0}_{1}'.format(event, tabname)
+            for event in ('update', 'delete') ]
+  known = sqlcon.execute( "SELECT count(*) FROM sqlite_master"
+                          " WHERE type='trigger' AND name IN (?, ?)",
+                          names ).fetchone()[0]
+  if known == len(names):
+    return True
+
+  started = not sqlcon.in_transaction
+  try:
+    create_versions_table(sqlcon)
+    sqlcon.execute( 'INSERT OR IGNORE INTO {0} (tabname, version)'
+                    ' VALUES (?, 0)'.format(VERSIONS_TABLE), (tabname,) )
+    for name, event in zip(names, ('UPDATE', 'DELETE')):
+      sqlcon.execute( "CREATE TRIGGER IF NOT EXISTS {0} AFTER {1} ON {2}"
+                      " BEGIN UPDATE {3} SET version = version + 1"
+                      " WHERE tabname = '{2}'; END"
+                      .format(name, event, tabname, VERSIONS_TABLE) )
+  except sqlite3.OperationalError as err:
+    if 'readonly' not in str(err):
+      raise
+    if started and sqlcon.in_transaction:
+      sqlcon.rollback()
+    return False
+  if started:
+    sqlcon.commit()
+  return True
+
+
+def table_version(sqlcon, tabname):
+  ''' (sqlite3.Connection, string) -> integer
+      Get the number of modifications of the table 'tabname' counted by
+      touch_table.
+  '''
+  if not table_exists(sqlcon, VERSIONS_TABLE):
+    return 0
+  version = sqlcon.execute( 'SELECT version FROM {0} WHERE tabname=?'
+                            .format(VERSIONS_TABLE), (tabname,) ).fetchone()
+  return version[0] if version else 0
+
+
+############################### INDEX MANAGEMENT ###############################
+# Name of the table that records the indexes maintained by gleaner.
+INDEX_TABLE = 'gleaner_indexes'
+
+# Minimal number of rows for tables to be indexed automatically.
+INDEX_MIN_ROWS = 10000
+
+# Ids of connections for which index creation is deferred.
+deferring_indexes = set()
+
+def index_name(tabname, columns):
+  ''' (string, array of strings) -> string
+      Name of the index on 'columns' of table 'tabname' maintained by gleaner.
+  '''
+  return '{0}_{1}_idx'.format(tabname, '_'.join(columns))
+
+
+def ensure_index(sqlcon, tabname, columns, defer=False, min_rows=0):
+  ''' (sqlite3.Connection, string, array of strings, bool, integer)
+      -> string or None
+
+      Make sure there is an index on 'columns' of the table 'tabname'.
+      Indexes are recorded in INDEX_TABLE, so an existing index is recognized
+      without creating it again. Tables with less than 'min_rows' rows are not
+      indexed.
+      SQLite may answer queries for the indexed columns alone from the index,
+      in the order of the index. Unordered fetches, like get_columns, are
+      therefore sorted by rowid, so separately fetched columns still line up.
+      A transaction already open on 'sqlcon' is left open, otherwise the
+      index is committed right away.
+      With 'defer', or inside deferred_indexes, the index is only recorded as
+      pending and built later by build_indexes.
+      Returned is the name of the index, or None if the table is too small or
+      the database is read-only.
+  '''
+  name = index_name(tabname, columns)
+  if table_exists(sqlcon, INDEX_TABLE):
+    known = sqlcon.execute( "SELECT count(*) FROM {0} AS g"
+                            " JOIN sqlite_master AS m"
+                            " ON m.name = g.name AND m.type = 'index'"
+                            " WHERE g.name = ? AND g.built = 1"
+                            .format(INDEX_TABLE), (name,) ).fetchone()[0]
+    if known:
+      return name
+
+  import sqlite3
+
+  started = not sqlcon.in_transaction
+  if defer or id(sqlcon) in deferring_indexes:
+    built = 0
+  elif max_rowid(sqlcon, tabname) < min_rows:
+    return None
+  else:
+    built = 1
+  try:
+    if built:
+      sqlcon.execute( 'CREATE INDEX IF NOT EXISTS {0} ON {1} ({2})'
+                      .format(name, tabname, ', '.join(columns)) )
+    sqlcon.execute( 'CREATE TABLE IF NOT EXISTS {0} (name TEXT PRIMARY KEY,'
+                    ' tabname TEXT, columns TEXT, built INTEGER)'
+                    .format(INDEX_TABLE) )
+    sqlcon.execute( 'INSERT OR REPLACE INTO {0} (name, tabname, columns, built)'
+                    ' VALUES (?, ?, ?, ?)'.format(INDEX_TABLE),
+                    (name, tabname, ', '.join(columns), built) )
+  except sqlite3.OperationalError as err:
+    # Read-only connections (see connect) just go without the index.
+    if 'readonly' not in str(err):
+      raise
+    if started and sqlcon.in_transaction:
+      sqlcon.rollback()
+    return None
+  if started:
+    sqlcon.commit()
+  return name
+
+
+def auto_index(sqlcon, tabname, columns, index=None):
+  ''' (sqlite3.Connection, string, array of strings, bool) -> string or None
+      Maintain an index on 'columns' of the table 'tabname' as selected by the
+      'index' argument of the querying functions: None creates it for tables
+      with at least INDEX_MIN_ROWS rows, True always and False never.
+      See ensure_index.
+  '''
+  if index is False:
+    return None
+  return ensure_index( sqlcon, tabname, columns,
+                       min_rows = INDEX_MIN_ROWS if index is None else 0 )
+
+
+def build_indexes(sqlcon, tabname=None):
+  ''' (sqlite3.Connection, string)
+      Build all pending indexes recorded by ensure_index, or only those for
+      the table 'tabname'. Indexes of tables that do not exist yet stay
+      pending.
+  '''
+  if not table_exists(sqlcon, INDEX_TABLE):
+    return
+  selquery = 'SELECT name, tabname, columns FROM {0} WHERE built = 0'.format(
+                 INDEX_TABLE )
+  params = ()
+  if tabname is not None:
+    selquery += ' AND tabname = ?'
+    params = (tabname,)
+  for name, tab, cols in sqlcon.execute(selquery, params).fetchall():
+    if not table_exists(sqlcon, tab):
+      continue
+    sqlcon.execute( 'CREATE INDEX IF NOT EXISTS {0} ON {1} ({2})'
+                    .format(name, tab, cols) )
+    sqlcon.execute( 'UPDATE {0} SET built = 1 WHERE name = ?'
+                    .format(INDEX_TABLE), (name,) )
   sqlcon.commit()
 
-  sqlcursor = sqlcon.execute('SELECT * FROM {0}'.format(tabname))
 
-  return list(map(lambda x: x[0], sqlcursor.description))
+@contextmanager
+def deferred_indexes(sqlcon):
+  ''' (sqlite3.Connection)
+      Context to defer the creation of indexes by ensure_index for 'sqlcon'
+      until the end of the context, for example during bulk ingestion.
+      The pending indexes are built when leaving the outermost context.
+  '''
+  nested = id(sqlcon) in deferring_indexes
+  deferring_indexes.add(id(sqlcon))
+  try:
+    yield sqlcon
+  finally:
+    if not nested:
+      deferring_indexes.discard(id(sqlcon))
+      build_indexes(sqlcon)
+
+
+def forget_indexes(sqlcon, tabname):
+  ''' (sqlite3.Connection, string)
+      Remove the records of indexes for the table 'tabname', which are dropped
+      along with the table.
+  '''
+  if table_exists(sqlcon, INDEX_TABLE):
+    sqlcon.execute( 'DELETE FROM {0} WHERE tabname=?'.format(INDEX_TABLE),
+                    (tabname,) )
+########################### END   index management #############################
+
+
+################################# MEMOIZATION ##################################
+# LRU cache for results of memoized functions, None while it is disabled.
+memo_cache = None
+
+# Maximal number of results kept in the memo_cache.
+memo_size = 0
+
+def enable_memo(maxsize=128):
+  ''' (integer)
+      Enable the memoization of query results for functions decorated by
+      memoized, keeping at most 'maxsize' results. The least recently used
+      results are evicted first.
+  '''
+  global memo_cache, memo_size
+
+  if memo_cache is None:
+    memo_cache = OrderedDict()
+  memo_size = maxsize
+  while len(memo_cache) > memo_size:
+    memo_cache.popitem(last=False)
+
+
+def disable_memo():
+  ''' ()
+      Disable the memoization of query results and drop all kept results.
+  '''
+  global memo_cache
+
+  memo_cache = None
+
+
+def database_file(sqlcon):
+  ''' (sqlite3.Connection) -> string or None
+      Get the filename of the main database connected by 'sqlcon', None for
+      databases in memory.
+  '''
+  for seq, name, dbfile in sqlcon.execute('PRAGMA database_list'):
+    if name == 'main' and dbfile:
+      return dbfile
+  return None
+
+
+def file_state(dbfile):
+  ''' (string) -> tuple
+      Modification time and size of the database file 'dbfile' and of its
+      write-ahead log. They change with commits by any connection or
+      program, and do not depend on the connection they are looked at from.
+  '''
+  import os
+
+  state = []
+  for path in (dbfile, dbfile + '-wal'):
+    if os.path.exists(path):
+      stat = os.stat(path)
+      state += [stat.st_mtime_ns, stat.st_size]
+  return tuple(state)
+
+
+def connection_token(sqlcon):
+  ''' (sqlite3.Connection) -> integer
+      Random token of the connection 'sqlcon', which is kept in the SQL
+      function gleaner_token of the connection. Unlike the id of the
+      connection it is not reused after the connection is closed, and it
+      does not keep the connection alive.
+  '''
+  import secrets
+  import sqlite3
 
+  try:
+    return sqlcon.execute('SELECT gleaner_token()').fetchone()[0]
+  except sqlite3.OperationalError:
+    token = secrets.randbits(62)
+    sqlcon.create_function('gleaner_token', 0, lambda: token,
+                           deterministic=True)
+    return token
+
+
+def database_state(sqlcon):
+  ''' (sqlite3.Connection) -> (object, tuple)
+      Identify the database connected by 'sqlcon' and the state of its data.
+      For a database file the state is given by its file_state along with
+      PRAGMA data_version and the number of changes made by the connection,
+      so it changes with every commit by any connection, even within the
+      resolution of the modification time. A database in memory is
+      identified by the id and the connection_token of its connection, its
+      state is given by PRAGMA data_version, the schema version and the
+      number of changes made by the connection.
+  '''
+  import os
 
-def get_columns(sqlcon, tabname, columns, as_nparray = False):
-  ''' (sqlite3.Connections, string, array of strings or string, bool)
+  versions = ( sqlcon.execute('PRAGMA data_version').fetchone()[0],
+               sqlcon.total_changes )
+  dbfile = database_file(sqlcon)
+  if dbfile:
+    return (os.path.abspath(dbfile), file_state(dbfile) + versions)
+  return ( (id(sqlcon), connection_token(sqlcon)),
+           versions + (sqlcon.execute('PRAGMA schema_version').fetchone()[0],) )
+
+
+def frozen(obj):
+  ''' (object) -> object
+      Hashable representation of an argument to a memoized function.
+      Raises TypeError for arguments that can not be represented.
+  '''
+  if isinstance(obj, (list, tuple)):
+    return tuple(frozen(item) for item in obj)
+  if isinstance(obj, dict):
+    return ('dict',) + tuple((key, frozen(val)) for key, val in obj.items())
+  if isinstance(obj, (set, frozenset)):
+    return frozenset(frozen(item) for item in obj)
+  if type(obj).__name__ == 'ndarray':
+    return ('ndarray', obj.dtype.str, obj.shape, obj.tobytes())
+  hash(obj)
+  return obj
+
+
+def memoized(fun):
+  ''' (function) -> function
+      Decorate a function with an 'sqlcon' argument, so its results are kept
+      in the memo_cache, if memoization is enabled by enable_memo.
+      Results are looked up by the function, its arguments and the database
+      along with the state of its data (see database_state). Any change of the
+      data, like an ingestion, thus invalidates the results automatically.
+      Calls inside an open transaction are never memoized.
+      Memoized results are shared between calls and must not be modified.
+  '''
+  import inspect
+
+  signature = inspect.signature(fun)
+
+  @wraps(fun)
+  def memo_fun(*args, **kwargs):
+    if memo_cache is None:
+      return fun(*args, **kwargs)
+    bound = signature.bind(*args, **kwargs)
+    bound.apply_defaults()
+    sqlcon = bound.arguments['sqlcon']
+    try:
+      argkey = frozen([ (name, val) for name, val in bound.arguments.items()
+                        if name != 'sqlcon' ])
+    except TypeError:
+      return fun(*args, **kwargs)
+    if sqlcon.in_transaction:
+      return fun(*args, **kwargs)
+
+    dbkey, state = database_state(sqlcon)
+    key = (dbkey, fun.__name__, argkey)
+    if key in memo_cache and memo_cache[key][0] == state:
+      memo_cache.move_to_end(key)
+      return memo_cache[key][1]
+
+    res = fun(*args, **kwargs)
+    if memo_cache is not None and not sqlcon.in_transaction:
+      if database_state(sqlcon) == (dbkey, state):
+        memo_cache[key] = (state, res)
+        memo_cache.move_to_end(key)
+        while len(memo_cache) > memo_size:
+          memo_cache.popitem(last=False)
+      else:
+        memo_cache.pop(key, None)
+    return res
+
+  return memo_fun
+############################ END   memoization #################################
+
+
+@memoized
+def get_columns(sqlcon, tabname, columns, as_nparray = False, cache = False,
+                order_by = None):
+  ''' (sqlite3.Connections, string, array of strings or string,
+       bool or string, bool or string, string)
         -> array of arrays or array (or np.array)
 
       Get 'columns' from the table 'tabname' in the database connected by
@@ -105,22 +921,31 @@ def get_columns(sqlcon, tabname, columns, as_nparray = False):
       Returned is a list that contains each requested column as a list or if
       there is only one column, just the list for that column, or if
       'as_nparray' is True as numpy array.
+      With 'as_nparray' set to '2d' or 'structured' a single numpy array is
+      returned instead, see fetch_columns.
+
+      All columns are fetched with a single query. 'order_by' is an optional
+      SQL expression to sort the rows by, for example 'coordX', by default
+      they are in the order of their rowid.
+
+      With 'cache' the numpy arrays are stored in a column cache on disk and
+      returned as read-only memory maps of the cached files, see
+      cached_columns. 'cache' is either True to put the cache next to the
+      database file, or the directory to use. The cache is only used for
+      unordered fetches of separate columns.
   '''
-  if as_nparray:
-    import numpy as np
-  sqlcursor = sqlcon.cursor()
-  res = []
   if isinstance(columns, list):
     my_cols = columns
   else:
     my_cols = [columns]
-  for col in my_cols:
-    selquery = 'SELECT {0} FROM {1};'.format(col, tabname)
-    sqlcursor.execute(selquery)
-    if as_nparray:
-      res.append(np.array([row[0] for row in sqlcursor.fetchall()]))
-    else:
-      res.append([row[0] for row in sqlcursor.fetchall()])
+  if as_nparray is True and cache and not order_by:
+    res = cached_columns(sqlcon, tabname, my_cols, cache)
+  else:
+    selquery = 'SELECT {0} FROM {1} ORDER BY {2}'.format(
+                   ', '.join(my_cols), tabname, order_by or 'rowid' )
+    res = fetch_columns(sqlcon, selquery, my_cols, as_nparray=as_nparray)
+    if as_nparray in ('2d', 'structured'):
+      return res
 
   if len(res) == 1:
     return res[0]
@@ -128,14 +953,445 @@ def get_columns(sqlcon, tabname, columns, as_nparray = False):
     return res
 
 
+def fetch_columns(sqlcon, query, columns, params=(), as_nparray=False):
+  ''' (sqlite3.Connection, string, array of strings, tuple, bool or string)
+      -> array of arrays (or np.array)
+
+      Run the SELECT 'query' with 'params' and return its result columns,
+      which are named by 'columns'.
+      Without 'as_nparray' a list with one list per column is returned, with
+      'as_nparray' True a list of numpy arrays.
+      With 'as_nparray' set to '2d' a single 2-D numpy array with one column
+      per requested column is returned, it is of object type if any of the
+      columns holds text. With 'structured' a structured numpy array with
+      fields named by 'columns' is returned.
+
+      The rows are written directly from the cursor into a numpy array, and
+      each column gets its type from the values it holds: integer columns
+      are exact int64, columns of integers, reals and NULLs are float64 (with
+      NULL as NaN) and text columns hold strings. Columns with any other mix
+      of values, like text and numbers, are object arrays of the values as
+      returned by SQLite.
+  '''
+  if as_nparray not in (False, None, True, '2d', 'structured'):
+    raise ValueError('Unknown array layout ' + str(as_nparray))
+  cur = sqlcon.execute(query, params)
+  if not as_nparray:
+    rows = cur.fetchall()
+    return [list(col) for col in zip(*rows)] if rows else [[] for c in columns]
+
+  import numpy as np
+
+  fields = [ ('f{0}'.format(i), 'O') for i in range(len(cur.description)) ]
+  arr = np.fromiter(cur, dtype=np.dtype(fields))
+  res = [ typed_column(arr[name]) for name, code in fields ]
+
+  if as_nparray == '2d':
+    if any(col.dtype == object for col in res):
+      res = [ arr[name] for name, code in fields ]
+    return np.column_stack(res) if res else np.empty((len(arr), 0))
+  if as_nparray == 'structured':
+    sarr = np.empty(len(arr), dtype=[ (name, col.dtype)
+                                      for name, col in zip(columns, res) ])
+    for name, col in zip(columns, res):
+      sarr[name] = col
+    return sarr
+  return [ np.array(col.tolist()) if col.dtype == object
+                                     and set(map(type, col)) == {str}
+           else col
+           for col in res ]
+
+
+def typed_column(col):
+  ''' (numpy.ndarray) -> numpy.ndarray
+      Convert the object array 'col' of values from SQLite to the type that
+      fits all of them, see fetch_columns. Mixed values are kept in the object
+      array.
+  '''
+  import numpy as np
+
+  kinds = set(map(type, col))
+  if kinds and kinds <= {int}:
+    return col.astype(np.int64)
+  if kinds <= {int, float, type(None)}:
+    return col.astype(np.float64)
+  return col
+
+
+def column_chunks(sqlcon, tabname, columns, chunksize=STREAM_CHUNKSIZE,
+                  where='', params=(), dtype=float, order_by=None):
+  ''' (sqlite3.Connection, string, array of strings, int, string, tuple,
+       numpy.dtype, string) -> generator of np.array
+
+      Stream 'columns' from the table 'tabname' in the database connected by
+      'sqlcon' in chunks of at most 'chunksize' rows.
+      Each chunk is a 2-D numpy array of 'dtype' with one column per requested
+      column, so only a single chunk has to be held in memory at any time.
+      'where' is an optional SQL condition to filter the rows by, it may
+      contain '?' placeholders that are filled by 'params'.
+      'order_by' is an optional SQL expression to sort the rows by, by default
+      they are in the order of their rowid.
+  '''
+  import numpy as np
+
+  selquery = 'SELECT {0} FROM {1}'.format(', '.join(columns), tabname)
+  if where:
+    selquery += ' WHERE {0}'.format(where)
+  selquery += ' ORDER BY {0}'.format(order_by or 'rowid')
+  cur = sqlcon.execute(selquery, params)
+  rows = cur.fetchmany(chunksize)
+  while rows:
+    yield np.array(rows, dtype=dtype).reshape(len(rows), len(columns))
+    rows = cur.fetchmany(chunksize)
+
+
+################################# LAZY TABLES ##################################
+class Dataset:
+  ''' A gleaner database, giving access to its tables as lazy Table objects.
+
+      >>> data = Dataset(':memory:')
+      >>> rows_to_db( data.sqlcon, [[0.5, 0.0, 1.2], [0.2, 0.05, 1.1],
+      ...                           [0.1, 0.3, 0.9]],
+      ...             ['coordX', 'coordY', 'pressure'], 'hline' )
+      >>> x, p = ( data['hline'].select('coordX', 'pressure')
+      ...                       .within(coordY=(0.0, 0.1))
+      ...                       .order_by('coordX').fetch() )
+      >>> print(x, p)
+      [0.2 0.5] [1.1 1.2]
+  '''
+
+  def __init__(self, database, readonly=False):
+    ''' (sqlite3.Connection or string, bool)
+        Wrap the connection 'database', or connect to the database file with
+        that name (see connect).
+    '''
+    if isinstance(database, (str, Path)):
+      database = connect(str(database), readonly=readonly)
+    self.sqlcon = database
+
+  def tables(self):
+    ''' () -> array of strings
+        Names of all tables in the database, except those kept by gleaner
+        for its own bookkeeping.
+    '''
+    return [ row[0] for row in self.sqlcon.execute(
+               "SELECT name FROM sqlite_master WHERE type='table'"
+               " AND name NOT LIKE 'gleaner\\_%' ESCAPE '\\'"
+               " ORDER BY name" ) ]
+
+  def table(self, tabname):
+    ''' (string) -> Table
+        Lazy view of all rows and columns of the table 'tabname'.
+    '''
+    return Table(self.sqlcon, tabname)
+
+  __getitem__ = table
+
+  def close(self):
+    ''' ()
+        Close the connection to the database.
+    '''
+    self.sqlcon.close()
+
+
+class Table:
+  ''' A lazy selection of rows and columns from a table in a database.
+
+      Selecting columns, filtering and ordering returns a new Table and does
+      not touch the database. All of them are combined into a single SQL
+      query that only runs when the data is materialized by fetch, chunks or
+      count.
+  '''
+
+  def __init__(self, sqlcon, tabname, columns=None, conditions=(), params=(),
+               order=None, limit=None):
+    ''' (sqlite3.Connection, string, array of strings, array of strings,
+         tuple, string, integer)
+        Select 'columns' (all if None) from the table 'tabname' for rows
+        meeting all SQL 'conditions', whose '?' placeholders are filled with
+        'params', sorted by 'order' and limited to 'limit' rows.
+    '''
+    self.sqlcon = sqlcon
+    self.tabname = tabname
+    self.selected = list(columns) if columns else None
+    self.conditions = tuple(conditions)
+    self.params = tuple(params)
+    self.order = order
+    self.nrows = limit
+
+  def derived(self, **changes):
+    ''' (keyword arguments) -> Table
+        Copy of this Table with some of its settings changed.
+    '''
+    settings = { 'columns': self.selected, 'conditions': self.conditions,
+                 'params': self.params, 'order': self.order,
+                 'limit': self.nrows }
+    settings.update(changes)
+    return Table(self.sqlcon, self.tabname, **settings)
+
+  @property
+  def columns(self):
+    ''' -> array of strings
+        Names of the selected columns.
+    '''
+    if self.selected:
+      return list(self.selected)
+    return table_columns(self.sqlcon, self.tabname)
+
+  def select(self, *columns):
+    ''' (strings) -> Table
+        Only use the given columns, which may also be SQL expressions.
+    '''
+    return self.derived(columns=columns)
+
+  def where(self, condition, *params):
+    ''' (string, values) -> Table
+        Only use rows meeting the SQL 'condition', with '?' placeholders
+        bound to 'params'.
+    '''
+    return self.derived( conditions=self.conditions + ('({0})'.format(condition),),
+                         params=self.params
+                                + tuple(bound_value(p) for p in params) )
+
+  def equal(self, **values):
+    ''' (keyword arguments) -> Table
+        Only use rows where each of the given columns equals its value, for
+        example equal(nProcs=64). Values are matched as in number_set, see
+        matching_params.
+    '''
+    res = self
+    for col, val in values.items():
+      res = res.where('{0} IN (?, ?)'.format(col), *matching_params(val))
+    return res
+
+  def between(self, column, low=None, high=None):
+    ''' (string, number, number) -> Table
+        Only use rows where 'column' lies within 'low' and 'high', including
+        the bounds. A bound of None is left open.
+    '''
+    res = self
+    if low is not None:
+      res = res.where('{0} >= ?'.format(column), low)
+    if high is not None:
+      res = res.where('{0} <= ?'.format(column), high)
+    return res
+
+  def within(self, **bounds):
+    ''' (keyword arguments of (number, number)) -> Table
+        Only use rows inside the bounding box given by (low, high) for each
+        of the columns, for example within(coordX=(0.0, 1.0), coordY=(0, 2)).
+    '''
+    res = self
+    for col, (low, high) in bounds.items():
+      res = res.between(col, low, high)
+    return res
+
+  def order_by(self, *columns):
+    ''' (strings) -> Table
+        Sort the rows by the given columns or SQL expressions.
+    '''
+    return self.derived(order=', '.join(columns))
+
+  def limit(self, nrows):
+    ''' (integer) -> Table
+        Use at most 'nrows' rows.
+    '''
+    return self.derived(limit=nrows)
+
+  def query(self):
+    ''' () -> (string, tuple)
+        The SQL query to fetch the selection and its parameters.
+    '''
+    selquery = 'SELECT {0} FROM {1}'.format(', '.join(self.columns),
+                                            self.tabname)
+    if self.conditions:
+      selquery += ' WHERE ' + ' AND '.join(self.conditions)
+    selquery += ' ORDER BY ' + (self.order or 'rowid')
+    if self.nrows is not None:
+      selquery += ' LIMIT {0:d}'.format(self.nrows)
+    return (selquery, self.params)
+
+  def fetch(self, as_nparray=True):
+    ''' (bool or string) -> array of arrays or array (or np.array)
+        Run the query and return the selected columns in the same shape as
+        get_columns, as numpy arrays by default. For 'as_nparray' see
+        fetch_columns.
+    '''
+    selquery, params = self.query()
+    cols = self.columns
+    res = fetch_columns(self.sqlcon, selquery, cols, params, as_nparray)
+    if as_nparray in ('2d', 'structured') or len(res) != 1:
+      return res
+    return res[0]
+
+  def to_numpy(self):
+    ''' () -> np.array
+        Run the query and return a 2-D numpy array with one column per
+        selected column.
+    '''
+    return self.fetch(as_nparray='2d')
+
+  def chunks(self, chunksize=STREAM_CHUNKSIZE):
+    ''' (integer) -> generator of np.array
+        Stream the selection in 2-D numpy arrays of at most 'chunksize' rows,
+        see column_chunks.
+    '''
+    if self.nrows is not None:
+      raise ValueError('Limited selections can not be streamed in chunks')
+    return column_chunks( self.sqlcon, self.tabname, self.columns,
+                          chunksize=chunksize,
+                          where=' AND '.join(self.conditions),
+                          params=self.params, order_by=self.order )
+
+  def count(self):
+    ''' () -> integer
+        Number of selected rows.
+    '''
+    selquery, params = self.derived(columns=['1']).query()
+    return self.sqlcon.execute( 'SELECT count(*) FROM ({0})'.format(selquery),
+                                params ).fetchone()[0]
+
+  def __repr__(self):
+    return 'Table({0!r}, {1!r})'.format(*self.query())
+############################ END   lazy tables #################################
+
+
+################################# COLUMN CACHE #################################
+def column_cache_dir(sqlcon, cache=True):
+  ''' (sqlite3.Connection, bool or string) -> pathlib.Path
+      Get the directory of the column cache for the database connected by
+      'sqlcon'. If 'cache' is True, this is the database filename with
+      '.columns' appended, otherwise 'cache' is the directory itself.
+  '''
+  if cache is not True:
+    return Path(cache)
+
+  dbfile = database_file(sqlcon)
+  if dbfile:
+    return Path(dbfile + '.columns')
+  raise ValueError( 'The column cache needs a directory for databases'
+                    ' that are not stored in a file.' )
+
+
+def cached_columns(sqlcon, tabname, columns, cache=True):
+  ''' (sqlite3.Connection, string, array of strings, bool or string)
+      -> array of numpy arrays
+
+      Get 'columns' from the table 'tabname' as numpy arrays out of the
+      column cache of the database (see column_cache_dir for 'cache').
+      Each column of a table is stored in its own .npy file, which is opened
+      as read-only memory map, so only the actually accessed parts of the
+      data are read.
+      Columns not in the cache yet, are read from the database and put into
+      the cache. The cache of a table is discarded, when the table was
+      modified by gleaner (see touch_table), rows in it were updated or
+      deleted (see watch_table), its largest rowid changed or the database
+      was replaced by another one (see database_token).
+      If the table can not be watched, because the connection is read-only,
+      the cache is also discarded with any change of the database, see
+      file_state.
+      Columns with mixed or missing values (and expressions instead of plain
+      column names) are not cached and just returned as numpy arrays.
+  '''
+  import json
+  import numpy as np
+
+  tabdir = column_cache_dir(sqlcon, cache) / tabname
+  watched = watch_table(sqlcon, tabname)
+  stamp = [ database_token(sqlcon), table_version(sqlcon, tabname),
+            sqlcon.execute('SELECT max(rowid) FROM ' + tabname).fetchone()[0] ]
+  if not watched:
+    stamp.append(list(file_state(database_file(sqlcon))))
+
+  stampfile = tabdir / 'stamp.json'
+  if not stampfile.exists() or json.loads(stampfile.read_text()) != stamp:
+    tabdir.mkdir(parents=True, exist_ok=True)
+    for colfile in tabdir.glob('*.npy'):
+      colfile.unlink()
+    stampfile.write_text(json.dumps(stamp))
+
+  res = []
+  for col in columns:
+    colfile = tabdir / (col + '.npy')
+    if not colfile.exists():
+      selquery = 'SELECT {0} FROM {1} ORDER BY rowid;'.format(col, tabname)
+      data = np.array([row[0] for row in sqlcon.execute(selquery)])
+      if data.dtype == object or not re.fullmatch(r'\w+', col):
+        res.append(data)
+        continue
+      tmpfile = tabdir / (col + '.tmp.npy')
+      np.save(tmpfile, data)
+      tmpfile.replace(colfile)
+    res.append(np.load(colfile, mmap_mode='r'))
+
+  return res
+########################### END   column cache #################################
+
+
 ################################# DATABASE CREATION ############################
+## Routine : Insert parsed rows
+def rows_to_db( sqlcon, rows, fieldnames, tabname,
+                col_to_string=untyped_colstring, batchsize=BULK_BATCHSIZE,
+                commit_rows=None ):
+  ''' (sqlite3.Connection, iterable of arrays or numpy.ndarray,
+       array of strings, string, fun(array of strings) -> string, integer,
+       integer)
+      Add the data in 'rows' to the table 'tabname' in the database connected
+      via 'sqlcon'. Each row has to provide one value for each of the
+      'fieldnames', which are used as headings for the columns.
+      'rows' may also be a 2-D NumPy array.
+
+      'col_to_string' is a function that is used to convert column names into a
+      string of names, potentially with type declarations for each field.
+
+      The rows are inserted in batches of 'batchsize' with a single prepared
+      statement. A commit is done by bulk_commit after at least
+      'commit_rows' rows, by default BULK_COMMIT_ROWS, so other connections
+      see the data as it streams in and transactions stay bounded, also
+      within an enclosing bulk_load context. 0 leaves all rows to a single
+      transaction.
+  '''
+
+  from itertools import islice
+
+  expand_table( sqlcon = sqlcon, tabname = tabname, columns = fieldnames,
+                col_to_string = col_to_string )
+
+  insert_string = insert_query(tabname, fieldnames)
+
+  if hasattr(rows, 'ndim'):
+    batches = ( rows[i:i+batchsize].tolist()
+                for i in range(0, len(rows), batchsize) )
+  else:
+    rows = iter(rows)
+    batches = iter(lambda: list(islice(rows, batchsize)), [])
+
+  if commit_rows is None:
+    commit_rows = BULK_COMMIT_ROWS
+
+  cur = sqlcon.cursor()
+  with bulk_load(sqlcon):
+    touch_table(sqlcon, tabname)
+    pending = 0
+    for batch in batches:
+      cur.executemany(insert_string, batch)
+      pending += len(batch)
+      if commit_rows and pending >= commit_rows:
+        bulk_commit(sqlcon)
+        pending = 0
+
+
 ## Routine : Load data and append it
 def file_to_db( sqlcon, filename, fieldnames, tabname,
-                skiprows=0, col_to_string=untyped_colstring, delimiter=' ' ):
+                skiprows=0, col_to_string=untyped_colstring, delimiter=' ',
+                batchsize=BULK_BATCHSIZE, offset=0, end=None, numeric=False,
+                constants=None ):
 
   '''
       ( string, array of strings, string, integer,
-        fun(array of strings) -> string, string )
+        fun(array of strings) -> string, string, integer, integer, integer,
+        bool, dict )
+      -> integer
       Read data from file 'filename' and add it to the table 'tabname' in the
       database connected via 'sqlcon'.
       Use 'fieldnames' as headings for the columns.
@@ -149,40 +1405,404 @@ def file_to_db( sqlcon, filename, fieldnames, tabname,
 
       'delimiter' is the characters to recognize as separators between columns.
       Defaults to spaces.
-  '''
 
-  import csv
+      The file is parsed in batches of 'batchsize' rows, which are inserted
+      with a single prepared statement. They are committed in bounded
+      transactions, see rows_to_db.
 
-  expand_table( sqlcon = sqlcon, tabname = tabname, columns = fieldnames,
-                col_to_string = col_to_string )
+      Only the part of the file from byte 'offset' up to byte 'end' is read,
+      by default up to its end. 'skiprows' counts from 'offset'.
+      Returned is the byte position up to which the file was read.
 
-  cur = sqlcon.cursor()
-  with open(filename, 'r') as csvfile:
-    datreader = csv.DictReader( csvfile, fieldnames=fieldnames,
-                                delimiter=delimiter,
-                                skipinitialspace=True )
+      With 'numeric' the file is read by load_numeric_array, this requires
+      all fields to be numbers separated by whitespace. The conversion to
+      floats is then done by NumPy instead of SQLite, which may differ in the
+      last bit.
+
+      'constants' may provide further columns with a single value for all
+      rows of the file, as a dict of column names and values.
+  '''
+
+  if end is None:
+    end = Path(filename).stat().st_size
+
+  if numeric:
+    rows = load_numeric_array(filename, skiprows, offset, end)
+  else:
+    lines = read_lines(filename, offset, end)
+    rows = fitted_rows(split_rows(lines, delimiter), len(fieldnames))
 
     for i in range(skiprows):
-      cols = next(datreader)
-
-    for row in datreader:
-      to_db = []
-      col_titles = []
-      for col in fieldnames:
-        to_db.append(row[col])
-        col_titles.append(first_word_of(col))
-      cur.execute( 'INSERT INTO {0} ({1}) VALUES ({2});'.format(
-                       tabname,
-                       ', '.join(col_titles),
-                       ', '.join('?'*len(col_titles)) ),
-                   to_db )
+      next(rows, None)
 
-  sqlcon.commit()
+  if constants:
+    rows = with_constants(rows, constants.values())
+    fieldnames = list(fieldnames) + list(constants.keys())
+
+  rows_to_db( sqlcon, rows, fieldnames, tabname,
+              col_to_string = col_to_string, batchsize = batchsize )
+
+  return end
+
+
+def with_constants(rows, values):
+  ''' (iterable of arrays or numpy.ndarray, array) -> same as rows
+      Append the same 'values' to each of the 'rows'.
+  '''
+  values = list(values)
+  if hasattr(rows, 'ndim'):
+    import numpy as np
+    if len(rows) == 0:
+      return rows
+    consts = np.array(values, dtype=np.float64)
+    return np.hstack([rows, np.broadcast_to(consts, (len(rows), len(values)))])
+
+  return (list(row) + values for row in rows)
 ########################### END   database creation ############################
 
 
-def add_to_db(fname, sqlcon, tabname, get_fieldnames, skiprows=1):
-  ''' (string or array of strings, sqlite3.Connection, string, function)
+## Routine : Parse a file in a worker process
+def parse_file(filename, get_fieldnames, skiprows=0, delimiter=' ', offset=0,
+               numeric=False):
+  ''' (string, function, integer, string, integer, bool)
+      -> (array of strings, list of lists or numpy.ndarray, integer)
+      Read the column names and all data rows from the file 'filename'.
+      The column names are obtained by 'get_fieldnames', the data is read
+      starting at byte 'offset' and the first 'skiprows' rows are skipped.
+      Fields are kept as strings, their conversion is left to the column
+      affinity in the database, just as in file_to_db.
+      With 'numeric' the data is read by load_numeric_array into a NumPy
+      array instead.
+      Returned are the column names, the rows and the byte position up to
+      which the file was read, its end.
+  '''
+
+  fieldnames = get_fieldnames(filename)
+  end = Path(filename).stat().st_size
+  if numeric:
+    return (fieldnames, load_numeric_array(filename, skiprows, offset, end),
+            end)
+
+  lines = read_lines(filename, offset, end)
+  rows = fitted_rows(split_rows(lines, delimiter), len(fieldnames))
+
+  for i in range(skiprows):
+    next(rows, None)
+
+  return (fieldnames, list(rows), end)
+
+
+def parsed_files(files, get_fieldnames, skiprows=0, nworkers=None,
+                 delimiter=' ', numeric=False):
+  ''' (array of strings or array of (string, integer) tuples, function,
+       integer, integer, string, bool)
+      -> generator of (string, array of strings, list of lists, integer)
+
+      Parse all 'files' with parse_file in a pool of 'nworkers' processes
+      (defaults to the number of CPUs).
+      Entries in 'files' may also be tuples of a filename and the byte offset
+      to start reading at, 'skiprows' is only applied to files that are read
+      from their start.
+      Results are yielded in the order of 'files' as soon as they are ready,
+      at most twice as many files as there are workers are kept in flight.
+      'get_fieldnames' needs to be a module level function, as it is passed
+      to the worker processes.
+  '''
+
+  import os
+  from collections import deque
+  from concurrent.futures import ProcessPoolExecutor
+
+  if not nworkers:
+    nworkers = os.cpu_count()
+
+  pending = deque()
+  with ProcessPoolExecutor(max_workers=nworkers) as pool:
+    for tfile in files:
+      if isinstance(tfile, tuple):
+        tfile, offset = tfile
+      else:
+        offset = 0
+      parsing = pool.submit( parse_file, tfile, get_fieldnames,
+                             skiprows if offset == 0 else 0,
+                             delimiter, offset, numeric )
+      pending.append( (tfile, parsing) )
+      if len(pending) > 2*nworkers:
+        tfile, parsing = pending.popleft()
+        yield (tfile,) + parsing.result()
+    while pending:
+      tfile, parsing = pending.popleft()
+      yield (tfile,) + parsing.result()
+
+
+def matching_files(fname):
+  ''' (string or array of strings) -> array of strings
+      Expand the globbing expression(s) in 'fname' to the list of all matching
+      files.
+  '''
+  import glob
+
+  if type(fname) in (list, tuple):
+    patterns = fname
+  else:
+    patterns = [fname]
+
+  files = []
+  for fin in patterns:
+    files += glob.glob(fin)
+  return files
+
+
+################################ FILE MANIFEST #################################
+# Name of the table that keeps track of the ingested files.
+MANIFEST_TABLE = 'gleaner_manifest'
+
+# Name of the table with the rowid ranges that were ingested from each file.
+MANIFEST_ROWS_TABLE = 'gleaner_manifest_rows'
+
+def update_digest(digest, filename, offset, end):
+  ''' (hashlib hash object, string, integer, integer) -> hashlib hash object
+      Feed the bytes from position 'offset' up to 'end' in 'filename' into
+      'digest' and return it.
+  '''
+  with open(filename, 'rb') as datfile:
+    datfile.seek(offset)
+    remaining = end - offset
+    while remaining > 0:
+      chunk = datfile.read(min(remaining, 1 << 20))
+      if not chunk:
+        break
+      digest.update(chunk)
+      remaining -= len(chunk)
+  return digest
+
+
+def file_digest(filename, nbytes):
+  ''' (string, integer) -> string
+      Compute the SHA-1 hash of the first 'nbytes' bytes in 'filename'.
+  '''
+  import hashlib
+
+  return update_digest(hashlib.sha1(), filename, 0, nbytes).hexdigest()
+
+
+def forget_ingested(sqlcon, tabname, filename=None):
+  ''' (sqlite3.Connection, string, string)
+      Remove all entries for the table 'tabname' from the manifest of ingested
+      files, or only those of 'filename' if it is given.
+  '''
+  import os
+
+  for manifest in (MANIFEST_TABLE, MANIFEST_ROWS_TABLE):
+    if not table_exists(sqlcon, manifest):
+      continue
+    if filename is None:
+      sqlcon.execute( 'DELETE FROM {0} WHERE tabname=?'.format(manifest),
+                      (tabname,) )
+    else:
+      sqlcon.execute( 'DELETE FROM {0} WHERE tabname=? AND path=?'
+                      .format(manifest), (tabname, os.path.abspath(filename)) )
+
+
+def record_ingested(sqlcon, filename, tabname, size, filehash=None):
+  ''' (sqlite3.Connection, string, string, integer, string)
+      Note in the manifest of the database that the first 'size' bytes of
+      'filename' are contained in the table 'tabname'.
+      Along with the size, the modification time and a hash of the ingested
+      content are stored. The hash is computed from the file, unless it is
+      already provided by 'filehash'.
+      The entry is part of the current transaction and not committed, it is
+      meant to be committed together with the last of the ingested rows.
+  '''
+  import os
+
+  if filehash is None:
+    filehash = file_digest(filename, size)
+
+  sqlcon.execute( 'CREATE TABLE IF NOT EXISTS {0} ('
+                  ' path TEXT, tabname TEXT, size INTEGER, mtime REAL,'
+                  ' hash TEXT, PRIMARY KEY (path, tabname))'
+                  .format(MANIFEST_TABLE) )
+  sqlcon.execute( 'INSERT OR REPLACE INTO {0} (path, tabname, size, mtime, hash)'
+                  ' VALUES (?, ?, ?, ?, ?)'.format(MANIFEST_TABLE),
+                  ( os.path.abspath(filename), tabname, size,
+                    os.stat(filename).st_mtime, filehash ) )
+
+
+def record_ingested_rows(sqlcon, filename, tabname, offset, rows):
+  ''' (sqlite3.Connection, string, string, integer, (integer, integer))
+      Note in the manifest of the database that the rowids in the range
+      'rows' (first and last) of the table 'tabname' were read from 'filename'
+      starting at byte 'offset'. They are used by drop_ingested_rows.
+      Empty ranges are not recorded. The entry is part of the current
+      transaction and not committed.
+  '''
+  import os
+
+  if rows[1] < rows[0]:
+    return
+  sqlcon.execute( 'CREATE TABLE IF NOT EXISTS {0} ('
+                  ' path TEXT, tabname TEXT, startpos INTEGER,'
+                  ' firstrow INTEGER, lastrow INTEGER)'
+                  .format(MANIFEST_ROWS_TABLE) )
+  sqlcon.execute( 'INSERT INTO {0} (path, tabname, startpos, firstrow, lastrow)'
+                  ' VALUES (?, ?, ?, ?, ?)'.format(MANIFEST_ROWS_TABLE),
+                  (os.path.abspath(filename), tabname, offset) + tuple(rows) )
+
+
+def drop_ingested_rows(sqlcon, filename, tabname, offset=0):
+  ''' (sqlite3.Connection, string, string, integer) -> integer
+      Delete the rows that were ingested from 'filename' into the table
+      'tabname' according to the manifest, starting at byte 'offset' of the
+      file, before that part of the file is read again. With an 'offset' of 0,
+      after the file was changed in place, all of its rows are deleted.
+      Otherwise only rows of an earlier ingestion that was interrupted after
+      some of its commits are found.
+      Rows of files that were recorded without their rowids can not be
+      found, they are kept and a warning is logged.
+      The deletion is part of the current transaction and not committed.
+      Returned is the number of deleted rows.
+  '''
+  import os
+
+  if not table_exists(sqlcon, tabname):
+    return 0
+
+  path = os.path.abspath(filename)
+  ranges = []
+  if table_exists(sqlcon, MANIFEST_ROWS_TABLE):
+    ranges = sqlcon.execute( 'SELECT firstrow, lastrow FROM {0}'
+                             ' WHERE path=? AND tabname=? AND startpos>=?'
+                             .format(MANIFEST_ROWS_TABLE),
+                             (path, tabname, offset) ).fetchall()
+  if not ranges:
+    if offset == 0 and table_exists(sqlcon, MANIFEST_TABLE):
+      known = sqlcon.execute( 'SELECT count(*) FROM {0}'
+                              ' WHERE path=? AND tabname=?'
+                              .format(MANIFEST_TABLE), (path, tabname) )
+      if known.fetchone()[0] > 0:
+        logging.warning( 'Rows of the changed file ' + filename + ' are not'
+                         ' recorded in the manifest, they stay in '
+                         + tabname )
+    return 0
+
+  ndropped = 0
+  for firstrow, lastrow in ranges:
+    ndropped += sqlcon.execute( 'DELETE FROM {0} WHERE rowid BETWEEN ? AND ?'
+                                .format(tabname), (firstrow, lastrow) ).rowcount
+  sqlcon.execute( 'DELETE FROM {0} WHERE path=? AND tabname=? AND startpos>=?'
+                  .format(MANIFEST_ROWS_TABLE), (path, tabname, offset) )
+  if ndropped > 0:
+    touch_table(sqlcon, tabname)
+  return ndropped
+
+
+@contextmanager
+def ingestion(sqlcon, filename, tabname, offset=0):
+  ''' (sqlite3.Connection, string, string, integer) -> dict
+      Context to add the data of 'filename' from byte 'offset' on to the
+      table 'tabname' within a bulk_load. Rows left by an interrupted
+      ingestion of the same part of the file are dropped first, see
+      drop_ingested_rows, and the rowids of the new rows are recorded in the
+      manifest with each commit. So the manifest stays consistent with the
+      table, even if the data of a file is committed in several
+      transactions. The entry of the file itself has to be recorded with
+      record_ingested inside the context by the caller.
+      Yielded is a dict, in which 'nrows' counts the added rows; it is
+      complete after the context.
+  '''
+  progress = {'nrows': 0}
+
+  def begin(sqlcon):
+    # Other writers have to wait within the transaction, so all rows past
+    # the largest rowid at its begin are appended from this file.
+    progress['firstrow'] = max_rowid(sqlcon, tabname) + 1
+
+  def record(sqlcon):
+    rows = (progress['firstrow'], max_rowid(sqlcon, tabname))
+    record_ingested_rows(sqlcon, filename, tabname, offset, rows)
+    progress['nrows'] += max(rows[1] - rows[0] + 1, 0)
+
+  with bulk_load(sqlcon):
+    drop_ingested_rows(sqlcon, filename, tabname, offset)
+    begin(sqlcon)
+    with bulk_load(sqlcon, on_commit=record, on_begin=begin):
+      yield progress
+    record(sqlcon)
+
+
+def ingested_rows_present(sqlcon, filename, tabname):
+  ''' (sqlite3.Connection, string, string) -> bool
+      Check whether the rows that were ingested from 'filename' into the table
+      'tabname' according to the manifest are all still there, they may have
+      been deleted independently of the manifest.
+      For files that were recorded without their rowids, it is only checked
+      that 'tabname' is not empty.
+  '''
+  import os
+
+  ranges = []
+  if table_exists(sqlcon, MANIFEST_ROWS_TABLE):
+    ranges = sqlcon.execute( 'SELECT firstrow, lastrow FROM {0}'
+                             ' WHERE path=? AND tabname=?'
+                             .format(MANIFEST_ROWS_TABLE),
+                             (os.path.abspath(filename), tabname) ).fetchall()
+  if not ranges:
+    return sqlcon.execute( 'SELECT EXISTS (SELECT 1 FROM {0})'
+                           .format(tabname) ).fetchone()[0] == 1
+
+  for firstrow, lastrow in ranges:
+    count = sqlcon.execute( 'SELECT count(*) FROM {0}'
+                            ' WHERE rowid BETWEEN ? AND ?'.format(tabname),
+                            (firstrow, lastrow) ).fetchone()[0]
+    if count != lastrow - firstrow + 1:
+      return False
+  return True
+
+
+def new_data_offset(sqlcon, filename, tabname):
+  ''' (sqlite3.Connection, string, string) -> integer or None
+      Find the byte position in 'filename' from which on its data is not yet
+      ingested into the table 'tabname' according to the manifest.
+      Returns None, if the file is unchanged since its ingestion, and 0 if it
+      was not ingested before, or its previously ingested content has changed.
+      If the file only grew by appending data, the size of the already
+      ingested part is returned.
+      The manifest is only trusted as long as the rows it recorded are still
+      in the table, see ingested_rows_present, otherwise 0 is returned.
+  '''
+  import os
+
+  if not ( table_exists(sqlcon, MANIFEST_TABLE)
+           and table_exists(sqlcon, tabname) ):
+    return 0
+
+  entry = sqlcon.execute( 'SELECT size, mtime, hash FROM {0}'
+                          ' WHERE path=? AND tabname=?'.format(MANIFEST_TABLE),
+                          (os.path.abspath(filename), tabname) ).fetchone()
+  if entry is None or not ingested_rows_present(sqlcon, filename, tabname):
+    return 0
+
+  size, mtime, filehash = entry
+  stat = os.stat(filename)
+  if stat.st_size == size and stat.st_mtime == mtime:
+    return None
+  if stat.st_size < size or file_digest(filename, size) != filehash:
+    return 0
+  if stat.st_size == size:
+    return None
+  if compression_of(filename) is not None:
+    # Compressed data can not be continued at a byte position.
+    return 0
+  return size
+########################### END   file manifest ################################
+
+
+def add_to_db(fname, sqlcon, tabname, get_fieldnames, skiprows=1, nworkers=1,
+              incremental=True, numeric=False, file_columns=None,
+              col_to_string=None):
+  ''' (string or array of strings, sqlite3.Connection, string, function,
+       integer, integer, bool, bool, function, fun(array of strings) -> string)
 
       Read data from files given in 'fname' and collect them
       in the database connected in 'sqlcon' in the table 'tabname' (which is
@@ -200,24 +1820,84 @@ def add_to_db(fname, sqlcon, tabname, get_fieldnames, skiprows=1):
 
       'skiprows' is the number of rows to skip in the read file.
 
+      'nworkers' is the number of processes to parse the files with. If it is
+      larger than 1 (or None for all CPUs) the files are parsed in parallel
+      and the writing to the database happens in this process as parsed files
+      become available. The resulting table is the same as for the serial
+      processing.
+
+      With 'incremental' the ingested files are recorded in a manifest table
+      in the database (path, size, modification time and content hash).
+      Files that did not change since they were added to 'tabname' are
+      skipped, and of files that only got data appended just the new part is
+      read. Files with changed content are read completely again, replacing
+      their previous rows, see drop_ingested_rows. The manifest entry of each
+      file is committed together with its last rows, see ingestion.
+
+      'numeric' files only contain numbers and can be read with the
+      vectorized load_numeric_array, see file_to_db.
+
+      'file_columns' may be a function that takes a filename and returns a
+      dict of further columns with their value for all rows of that file,
+      for example the simulation time encoded in the filename.
+
+      'col_to_string' declares the column types in the table, it defaults to
+      tracking_colstring.
   '''
-  import glob
-  if type(fname) in (list, tuple):
-    for fin in fname:
-      files = glob.glob(fin)
-      for tfile in files:
-        fieldnames = get_fieldnames(tfile)
-        file_to_db( sqlcon, tfile, fieldnames, tabname, skiprows,
-                    col_to_string = tracking_colstring )
-  else:
-    files = glob.glob(fname)
+
+  if col_to_string is None:
+    col_to_string = tracking_colstring
+
+  files = matching_files(fname)
+
+  if incremental:
+    pending = []
     for tfile in files:
+      offset = new_data_offset(sqlcon, tfile, tabname)
+      if offset is None:
+        logging.info('Skipping unchanged file ' + tfile)
+      else:
+        pending.append((tfile, offset))
+  else:
+    pending = [(tfile, 0) for tfile in files]
+
+  offsets = dict(pending)
+  if nworkers != 1 and len(pending) > 1:
+    for tfile, fieldnames, rows, end in parsed_files(pending, get_fieldnames,
+                                                     skiprows, nworkers,
+                                                     numeric = numeric):
+      if file_columns is not None:
+        constants = file_columns(tfile)
+        rows = with_constants(rows, constants.values())
+        fieldnames = fieldnames + list(constants.keys())
+      if not incremental:
+        rows_to_db( sqlcon, rows, fieldnames, tabname,
+                    col_to_string = col_to_string )
+        continue
+      with ingestion(sqlcon, tfile, tabname, offsets[tfile]):
+        rows_to_db( sqlcon, rows, fieldnames, tabname,
+                    col_to_string = col_to_string )
+        record_ingested(sqlcon, tfile, tabname, end)
+  else:
+    for tfile, offset in pending:
       fieldnames = get_fieldnames(tfile)
-      file_to_db( sqlcon, tfile, fieldnames, tabname, skiprows,
-                  col_to_string = tracking_colstring )
-
-def connect_and_add_to_db(fname, dbname, tabname, get_fieldnames, skiprows=1):
-  ''' (string or array of strings, string, string) -> sqlite3.Connection
+      constants = file_columns(tfile) if file_columns else None
+      if not incremental:
+        file_to_db( sqlcon, tfile, fieldnames, tabname, skiprows,
+                    col_to_string = col_to_string, numeric = numeric,
+                    constants = constants )
+        continue
+      with ingestion(sqlcon, tfile, tabname, offset):
+        end = file_to_db( sqlcon, tfile, fieldnames, tabname,
+                          skiprows if offset == 0 else 0,
+                          col_to_string = col_to_string, offset = offset,
+                          numeric = numeric, constants = constants )
+        record_ingested(sqlcon, tfile, tabname, end)
+
+def connect_and_add_to_db(fname, dbname, tabname, get_fieldnames, skiprows=1,
+                          nworkers=1, numeric=False):
+  ''' (string or array of strings, string, string, function, integer,
+       integer, bool) -> sqlite3.Connection
       Read timing data from timing.res files given in 'fname', and collect them
       in the database file 'dbname' in the table 'tabname' (which is created if
       it does not yet exist).
@@ -229,22 +1909,199 @@ def connect_and_add_to_db(fname, dbname, tabname, get_fieldnames, skiprows=1):
       be added to the database.
 
       'dbname' is the name of the database file to connect with. See
-      sqlite3.connect for details.
+      connect for details.
 
       'get_fieldnames' has to be a function that takes a filename and extracts
       the column names for the table from it before attempting to get its
       data into the table.
 
       'skiprows' is the number of rows to skip in the read file.
-  '''
 
-  import sqlite3
+      'nworkers' is the number of processes to parse files with, see add_to_db.
 
-  sqlcon = sqlite3.connect(dbname)
-  add_to_db(fname, sqlcon, tabname, get_fieldnames, skiprows)
+      'numeric' files are read with load_numeric_array, see add_to_db.
+  '''
+
+  sqlcon = connect(dbname)
+  add_to_db( fname, sqlcon, tabname, get_fieldnames, skiprows, nworkers,
+             numeric = numeric )
   return sqlcon
 
 
+################################# FOLLOW MODE ##################################
+# Number of rows per executemany call when following growing files.
+FOLLOW_BATCHSIZE = 1000
+
+# Number of bytes at the start of a followed file that are compared between
+# polls to notice that the file was rewritten.
+FOLLOW_HEAD_BYTES = 4096
+
+def complete_size(filename, offset=0):
+  ''' (string, integer) -> integer
+      Get the byte position right after the last complete line in 'filename'.
+      Only the part after 'offset' is searched, if there is no line end in
+      it, 'offset' is returned.
+  '''
+  with open(filename, 'rb') as datfile:
+    pos = datfile.seek(0, 2)
+    while pos > offset:
+      step = min(pos - offset, 1 << 16)
+      pos -= step
+      datfile.seek(pos)
+      lastend = datfile.read(step).rfind(b'\n')
+      if lastend >= 0:
+        return pos + lastend + 1
+  return offset
+
+
+def readable_end(filename, offset=0):
+  ''' (string, integer) -> integer
+      Get the byte position up to which 'filename' can be read from 'offset'
+      on: the end of its last complete line, see complete_size.
+      Compressed files can only be read as a whole, for them this is the
+      size of the file if 'offset' is 0, and 'offset' otherwise.
+  '''
+  import os
+
+  if compression_of(filename) is not None:
+    return os.stat(filename).st_size if offset == 0 else offset
+  return complete_size(filename, offset)
+
+
+def max_rowid(sqlcon, tabname):
+  ''' (sqlite3.Connection, string) -> integer
+      Get the largest rowid in table 'tabname', 0 if it is empty or does not
+      exist.
+  '''
+  if not table_exists(sqlcon, tabname):
+    return 0
+  lastrow = sqlcon.execute('SELECT max(rowid) FROM ' + tabname).fetchone()[0]
+  return lastrow or 0
+
+
+def header_complete(filename, nlines):
+  ''' (string, integer) -> bool
+      Check whether the first 'nlines' lines in 'filename' are completely
+      written.
+  '''
+  with open_data(filename) as datfile:
+    for i in range(nlines):
+      if not datfile.readline().endswith(b'\n'):
+        return False
+  return True
+
+
+def follow_step(fname, sqlcon, tabname, get_fieldnames, state, skiprows=1,
+                batchsize=FOLLOW_BATCHSIZE):
+  ''' (string or array of strings, sqlite3.Connection, string, function,
+       dict, integer, integer) -> integer
+
+      Add all complete lines that were written to the files matching 'fname'
+      since the last call to the table 'tabname', see add_to_db for the
+      meaning of the arguments.
+      The reading position for each file is kept in the dict 'state', which
+      should be empty on the first call and passed in again on subsequent
+      calls. Files that are not in 'state' yet are looked up in the manifest
+      of the database, so data that was already ingested before is not read
+      again.
+      Files that shrank or whose first FOLLOW_HEAD_BYTES bytes changed since
+      the last call were rewritten, for example by a restarted simulation.
+      Their rows are dropped and they are read again from their start.
+      New data of each file is committed right away together with its record
+      in the manifest, see ingestion.
+      Returned is the number of rows added.
+  '''
+  import hashlib
+  import os
+
+  nrows = 0
+  for tfile in matching_files(fname):
+    path = os.path.abspath(tfile)
+    if path not in state:
+      offset = new_data_offset(sqlcon, tfile, tabname)
+      if offset is None:
+        offset = sqlcon.execute( 'SELECT size FROM {0}'
+                                 ' WHERE path=? AND tabname=?'
+                                 .format(MANIFEST_TABLE),
+                                 (path, tabname) ).fetchone()[0]
+      state[path] = ( offset, update_digest(hashlib.sha1(), tfile, 0, offset),
+                      file_digest(tfile, min(offset, FOLLOW_HEAD_BYTES)) )
+
+    offset, digest, head = state[path]
+    if offset > 0:
+      size = os.stat(tfile).st_size
+      if ( size < offset
+           or (size != offset and compression_of(tfile) is not None)
+           or file_digest(tfile, min(offset, FOLLOW_HEAD_BYTES)) != head ):
+        logging.info('Reading the rewritten file ' + tfile + ' again')
+        with bulk_load(sqlcon):
+          drop_ingested_rows(sqlcon, tfile, tabname)
+          forget_ingested(sqlcon, tabname, tfile)
+        offset, digest = 0, hashlib.sha1()
+        state[path] = (offset, digest, file_digest(tfile, 0))
+
+    end = readable_end(tfile, offset)
+    if end == offset:
+      continue
+    if offset == 0 and not header_complete(tfile, skiprows):
+      continue
+
+    fieldnames = get_fieldnames(tfile)
+    with ingestion(sqlcon, tfile, tabname, offset) as progress:
+      file_to_db( sqlcon, tfile, fieldnames, tabname,
+                  skiprows if offset == 0 else 0,
+                  col_to_string = tracking_colstring, batchsize = batchsize,
+                  offset = offset, end = end )
+      update_digest(digest, tfile, offset, end)
+      record_ingested(sqlcon, tfile, tabname, end, digest.hexdigest())
+    nrows += progress['nrows']
+    state[path] = (end, digest, file_digest(tfile, min(end, FOLLOW_HEAD_BYTES)))
+
+  return nrows
+
+
+def follow_to_db(fname, sqlcon, tabname, get_fieldnames, skiprows=1,
+                 interval=10.0, polls=None, callback=None,
+                 batchsize=FOLLOW_BATCHSIZE):
+  ''' (string or array of strings, sqlite3.Connection, string, function,
+       integer, float, integer, function, integer) -> integer
+
+      Follow the files matching 'fname' while they are written and add their
+      data to the table 'tabname' in the database connected by 'sqlcon'.
+      Every 'interval' seconds the globbing expressions in 'fname' are
+      expanded again and newly appended lines as well as newly created files
+      are added with follow_step. Lines are only read once they are complete.
+
+      'get_fieldnames' and 'skiprows' have the same meaning as in add_to_db.
+
+      Following stops after 'polls' rounds, by default it continues until it
+      is interrupted.
+      If a 'callback' is given, it is called with the connection and the
+      number of new rows after each round that added data. This can be used
+      to update plots while a simulation is running.
+      Returned is the total number of added rows.
+  '''
+  import time
+
+  state = {}
+  total = 0
+  npolls = 0
+  while polls is None or npolls < polls:
+    if npolls > 0:
+      time.sleep(interval)
+    nrows = follow_step( fname, sqlcon, tabname, get_fieldnames, state,
+                         skiprows, batchsize )
+    npolls += 1
+    total += nrows
+    if nrows > 0:
+      logging.info('Added {0} rows to {1}'.format(nrows, tabname))
+      if callback is not None:
+        callback(sqlcon, nrows)
+
+  return total
+########################### END   follow mode ##################################
+
+
 ################### Methods to treat timing.res data. ##########################
 def timing_colstring(columns):
   """ (array of strings) -> string
@@ -308,7 +2165,7 @@ def get_timing_header(filename):
 
   # Find and store the file header line for column names
   colhead = []
-  with open(filename, 'r') as csvfile:
+  with open_text(filename) as csvfile:
     timereader = csv.reader( csvfile, delimiter = ' ',
                              skipinitialspace = True  )
     cols = next(timereader)
@@ -336,22 +2193,28 @@ def get_timing_header(filename):
   return unified
 
 
-def load_timing_dataframe(filename):
-  """ (string or pathlib.Path) -> pandas.DataFrame
-      Read timing data into a pandas DataFrame using the extracted header.
+def read_timing_file(filename, engine='c', text_columns=()):
+  """ (string or pathlib.Path, string, array of strings) -> pandas.DataFrame
+      Read a single timing.res file into a pandas DataFrame using the extracted
+      header. The columns in 'text_columns' are always read as strings.
+      Compressed files are decompressed while reading.
+      'engine' is the parser engine of pandas.read_csv, the compiled 'c'
+      parser by default.
   """
 
   import pandas as pd
 
-  filename = Path(filename)
   header_names = get_timing_header(filename)
 
   df = pd.read_csv(
       filename,
       sep=r'\s+',
-      engine='python',
+      engine=engine,
       comment='#',
-      header=None
+      header=None,
+      compression=compression_of(filename),
+      dtype={header_names.index(col): str for col in text_columns
+                                          if col in header_names}
   )
 
   if df.shape[1] != len(header_names):
@@ -364,8 +2227,63 @@ def load_timing_dataframe(filename):
   return df
 
 
-def timing_to_db(fname, dbname, tabname):
-  ''' (string or array of strings, string, string) -> sqlite3.Connection
+def load_timing_dataframe(filename, source_column='File', nworkers=1,
+                          engine='c', categories=('Revision', 'Casename')):
+  """ (string or pathlib.Path or array of those, string, integer, string,
+       array of strings) -> pandas.DataFrame
+      Read timing data into a pandas DataFrame using the extracted header.
+
+      'filename' might also be a globbing expression or a list of them, then
+      the data of all matching files is concatenated and the column named
+      by 'source_column' states the file each row was read from.
+      With more than one of 'nworkers' (None for all CPUs), the files are
+      read by concurrent threads.
+      The columns in 'categories' are stored as categoricals.
+      'engine' is the parser engine of pandas.read_csv, the compiled 'c'
+      parser by default.
+  """
+
+  import glob
+  import pandas as pd
+
+  if isinstance(filename, (list, tuple)) or glob.has_magic(str(filename)):
+    if isinstance(filename, (list, tuple)):
+      files = matching_files([str(fin) for fin in filename])
+    else:
+      files = matching_files(str(filename))
+    if not files:
+      raise ValueError('No timing files found for {0}'.format(filename))
+  else:
+    files = [Path(filename)]
+    source_column = None
+
+  def read(tfile):
+    return read_timing_file(tfile, engine, text_columns=categories)
+
+  if nworkers != 1 and len(files) > 1:
+    from concurrent.futures import ThreadPoolExecutor
+    with ThreadPoolExecutor(max_workers=nworkers) as pool:
+      frames = list(pool.map(read, files))
+  else:
+    frames = [read(tfile) for tfile in files]
+
+  if source_column:
+    for tfile, frame in zip(files, frames):
+      frame[source_column] = str(tfile)
+
+  df = pd.concat(frames, ignore_index=True) if len(frames) > 1 else frames[0]
+
+  for col in categories:
+    if col in df.columns:
+      df[col] = df[col].astype('category')
+  if source_column:
+    df[source_column] = df[source_column].astype('category')
+
+  return df
+
+
+def timing_to_db(fname, dbname, tabname, nworkers=1):
+  ''' (string or array of strings, string, string, integer) -> sqlite3.Connection
       Read timing data from timing.res files given in 'fname', and collect them
       in the database file 'dbname' in the table 'tabname' (which is created if
       it does not yet exist).
@@ -377,14 +2295,17 @@ def timing_to_db(fname, dbname, tabname):
       be added to the database.
 
       'dbname' is the name of the database file to connect with. See
-      sqlite3.connect for details.
+      connect for details.
+
+      'nworkers' is the number of processes to parse files with, see add_to_db.
   '''
 
-  return connect_and_add_to_db(fname, dbname, tabname, get_timing_header, skiprows=1)
+  return connect_and_add_to_db(fname, dbname, tabname, get_timing_header, skiprows=1,
+                               nworkers=nworkers)
 
 
-def add_timing_to_db(fname, sqlcon, tabname):
-  ''' (string or array of strings, sqlite3.Connection, string)
+def add_timing_to_db(fname, sqlcon, tabname, nworkers=1):
+  ''' (string or array of strings, sqlite3.Connection, string, integer)
       Read timing data from timing.res files given in 'fname', and collect them
       in the database given by sqlcon in the table 'tabname' (which is created if
       it does not yet exist).
@@ -396,9 +2317,25 @@ def add_timing_to_db(fname, sqlcon, tabname):
       be added to the database.
 
       'sqlcon' is the Connector of an existing database.
+
+      'nworkers' is the number of processes to parse files with, see add_to_db.
+  '''
+
+  add_to_db(fname, sqlcon, tabname, get_timing_header, skiprows=1,
+            nworkers=nworkers)
+
+
+def timing_follow(fname, sqlcon, tabname, interval=10.0, polls=None,
+                  callback=None):
+  ''' (string or array of strings, sqlite3.Connection, string, float,
+       integer, function) -> integer
+      Follow timing.res files given in 'fname' while they grow and add their
+      new lines to the table 'tabname' in the database given by sqlcon.
+      See follow_to_db for the meaning of 'interval', 'polls' and 'callback'.
   '''
 
-  add_to_db(fname, sqlcon, tabname, get_timing_header, skiprows=1)
+  return follow_to_db( fname, sqlcon, tabname, get_timing_header, skiprows=1,
+                       interval=interval, polls=polls, callback=callback )
 
 ################################ End timing.res ################################
 
@@ -434,7 +2371,7 @@ def get_tracking_header(filename):
 
   # Find and store the file header line for column names
   colhead = []
-  with open(filename, 'r') as csvfile:
+  with open_text(filename) as csvfile:
     timereader = csv.reader( csvfile, delimiter = ' ',
                              skipinitialspace = True  )
     colhead = next(timereader)
@@ -446,8 +2383,33 @@ def get_tracking_header(filename):
 
   return colhead
 
-def tracking_append(fname, sqlcon, tabname):
-  ''' (string or array of strings, sqlite3.Connection, string)
+def load_tracking_array(filename, columns=None):
+  """ (string, array of strings) -> array of strings, numpy.ndarray
+      Read an ASCII tracking file into a 2-D float64 array with one row per
+      point and one column per entry in the header.
+      Returned are the column names from get_tracking_header and the array.
+      If 'columns' is given, only those columns are read, in the given order.
+  """
+
+  header = get_tracking_header(filename)
+  if columns is None:
+    usecols = None
+  else:
+    if not isinstance(columns, list):
+      columns = [columns]
+    usecols = [header.index(col) for col in columns]
+    header = list(columns)
+
+  data = load_numeric_array(filename, skiprows=2, usecols=usecols)
+  if data.size == 0:
+    data = data.reshape(0, len(header))
+
+  return header, data
+
+
+def tracking_append(fname, sqlcon, tabname, nworkers=1, numeric=False):
+  ''' (string or array of strings, sqlite3.Connection, string, integer,
+       bool)
 
       Read tracking data from files given in 'fname' and collect them
       in the database connected in 'sqlcon' in the table 'tabname' (which is
@@ -459,12 +2421,19 @@ def tracking_append(fname, sqlcon, tabname):
       as a globbing expression and all files matching the globbing pattern will
       be added to the database.
 
+      'nworkers' is the number of processes to parse files with, see add_to_db.
+
+      With 'numeric' the files are read by the vectorized parser in
+      load_numeric_array. The conversion to floats is then done by NumPy
+      instead of SQLite, which may differ in the last bit.
   '''
 
-  add_to_db(fname, sqlcon, tabname, get_tracking_header, skiprows=2)
+  add_to_db(fname, sqlcon, tabname, get_tracking_header, skiprows=2,
+            nworkers=nworkers, numeric=numeric)
 
-def tracking_to_db(fname, dbname, tabname):
-  ''' (string or array of strings, string) -> sqlite3.Connection
+def tracking_to_db(fname, dbname, tabname, nworkers=1, numeric=False):
+  ''' (string or array of strings, string, integer, bool)
+      -> sqlite3.Connection
       Read tracking data from files given in 'fname', and collect them
       in the database file 'dbname' in the table 'tabname' (which is created if
       it does not yet exist).
@@ -476,11 +2445,267 @@ def tracking_to_db(fname, dbname, tabname):
       be added to the database.
 
       'dbname' is the name of the database file to connect with. See
-      sqlite3.connect for details.
+      connect for details.
+      A resulting connector to the database will be returned.
+
+      'nworkers' is the number of processes to parse files with, see add_to_db.
+
+      With 'numeric' the files are read by the vectorized parser in
+      load_numeric_array. The conversion to floats is then done by NumPy
+      instead of SQLite, which may differ in the last bit.
+  '''
+
+  return connect_and_add_to_db(fname, dbname, tabname, get_tracking_header, skiprows=2,
+                               nworkers=nworkers, numeric=numeric)
+
+
+def tracking_follow(fname, sqlcon, tabname, interval=10.0, polls=None,
+                    callback=None):
+  ''' (string or array of strings, sqlite3.Connection, string, float,
+       integer, function) -> integer
+      Follow the tracking files given in 'fname' while a simulation is running
+      and add new lines, as well as newly created files, to the table
+      'tabname' in the database given by sqlcon.
+      See follow_to_db for the meaning of 'interval', 'polls' and 'callback'.
+  '''
+
+  return follow_to_db( fname, sqlcon, tabname, get_tracking_header, skiprows=2,
+                       interval=interval, polls=polls, callback=callback )
+
+# Filenames of tracking output from the APES tools, possibly compressed:
+# [L<level>_]<label>_p<rank>_t<time>.res[.gz|.bz2|.xz|.zst]
+TRACKING_FILE_PATTERN = re.compile(
+    r'^(L(?P<level>\d+)_)?.*_p(?P<rank>\d+)_t(?P<time>[^_]+)\.res'
+    r'(\.(gz|bz2|xz|zst))?$' )
+
+def tracking_file_info(filename):
+  """ (string) -> dict
+      Get the simulation time, the level and the process rank from the name
+      of a tracking file written by the APES tools.
+      The level is None, if it is not encoded in the filename.
+      Compressed files may carry a suffix like .gz after the .res.
+
+      Example:
+      >>> tracking_file_info('tracking/L7_vel_global_p00000_t1.037E+00.res')
+      {'time': 1.037, 'level': 7, 'rank': 0}
+      >>> tracking_file_info('tracking/vel_global_p00003_t2.0E+00.res.gz')
+      {'time': 2.0, 'level': None, 'rank': 3}
+  """
+  match = TRACKING_FILE_PATTERN.match(Path(filename).name)
+  if match is None:
+    raise ValueError( 'No rank and time found in tracking filename '
+                      + str(filename) )
+
+  level = match.group('level')
+  return { 'time': float(match.group('time')),
+           'level': int(level) if level else None,
+           'rank': int(match.group('rank')) }
+
+
+def tracking_series_colstring(columns):
+  """ (array of strings) -> string
+
+      Create a string to represent <columns> names of a tracking series,
+      suitable to be used in SQL queries.
+      Like tracking_colstring, but the level and rank from the filenames are
+      integers.
+
+      Example:
+      >>> tracking_series_colstring(['coordX', 'time', 'rank'])
+      'coordX REAL, time REAL, rank INTEGER'
+  """
+  columntypes = { 'level': 'INTEGER',
+                  'rank' : 'INTEGER' }
+
+  typedColumns = []
+  for col in columns:
+    colname = first_word_of(col)
+    typedColumns.append( '{0} {1}'.format(colname,
+                                          columntypes.get(colname, 'REAL')) )
+
+  return ', '.join(typedColumns)
+
+
+def tracking_series_append(fname, sqlcon, tabname, nworkers=1, numeric=False):
+  ''' (string or array of strings, sqlite3.Connection, string, integer,
+       bool)
+
+      Read tracking data from the files for all time steps given in 'fname'
+      into the single table 'tabname' in the database connected in 'sqlcon'.
+      The simulation time, level and process rank are taken from the
+      filenames (see tracking_file_info) and stored in the columns 'time',
+      'level' and 'rank' of each row.
+      An index on time and rank is created for the table (see ensure_index),
+      so single frames can be looked up quickly with tracking_frame. It is
+      built after the files were added, see deferred_indexes.
+
+      'fname' might be a list of strings, or a single string. It is processed
+      as a globbing expression and all files matching the globbing pattern will
+      be added to the database.
+
+      For 'nworkers' and 'numeric' see tracking_append.
+  '''
+
+  with deferred_indexes(sqlcon):
+    ensure_index(sqlcon, tabname, ['time', 'rank'])
+    add_to_db( fname, sqlcon, tabname, get_tracking_header, skiprows=2,
+               nworkers=nworkers, numeric=numeric,
+               file_columns=tracking_file_info,
+               col_to_string=tracking_series_colstring )
+
+
+def tracking_series_to_db(fname, dbname, tabname, nworkers=1, numeric=False):
+  ''' (string or array of strings, string, string, integer, bool)
+      -> sqlite3.Connection
+      Read tracking data from the files for all time steps given in 'fname'
+      into the single table 'tabname' in the database file 'dbname', see
+      tracking_series_append.
       A resulting connector to the database will be returned.
   '''
 
-  return connect_and_add_to_db(fname, dbname, tabname, get_tracking_header, skiprows=2)
+  sqlcon = connect(dbname)
+  tracking_series_append(fname, sqlcon, tabname, nworkers, numeric)
+  return sqlcon
+
+
+def tracking_times(sqlcon, tabname):
+  ''' (sqlite3.Connection, string) -> array of floats
+      Get the sorted list of all simulation times in the tracking series
+      stored in table 'tabname'.
+  '''
+
+  selquery = 'SELECT DISTINCT time FROM {0} ORDER BY time'.format(tabname)
+  return [row[0] for row in sqlcon.execute(selquery)]
+
+
+def tracking_frame(sqlcon, tabname, time, columns, as_nparray=False,
+                   order_by='rank'):
+  ''' (sqlite3.Connection, string, float, array of strings or string,
+       bool or string, string)
+      -> array of arrays or array (or np.array)
+
+      Get 'columns' for the single time step closest to 'time' out of the
+      tracking series in table 'tabname' (see tracking_series_append).
+      The rows are ordered by 'order_by', the process rank by default, and
+      rows that tie by their rowid, so columns fetched by separate calls
+      line up. They come in the same shape as from get_columns.
+  '''
+
+  below = sqlcon.execute( 'SELECT max(time) FROM {0} WHERE time <= ?'
+                          .format(tabname), (time,) ).fetchone()[0]
+  above = sqlcon.execute( 'SELECT min(time) FROM {0} WHERE time >= ?'
+                          .format(tabname), (time,) ).fetchone()[0]
+  if below is None and above is None:
+    raise ValueError('No time steps found in table ' + tabname)
+  if below is None or (above is not None and above - time < time - below):
+    frametime = above
+  else:
+    frametime = below
+
+  if isinstance(columns, list):
+    my_cols = columns
+  else:
+    my_cols = [columns]
+
+  selquery = 'SELECT {0} FROM {1} WHERE time = ? ORDER BY {2}, rowid'.format(
+                 ', '.join(my_cols), tabname, order_by )
+  res = fetch_columns(sqlcon, selquery, my_cols, params=(frametime,),
+                      as_nparray=as_nparray)
+  if as_nparray in ('2d', 'structured'):
+    return res
+
+  if len(res) == 1:
+    return res[0]
+  else:
+    return res
+
+
+def group_tracking_files(fname):
+  ''' (string or array of strings) -> array of (float, array of strings)
+      Group the tracking files matching the globbing expression(s) in 'fname'
+      by their simulation time (see tracking_file_info).
+      Returned is a list of (time, files) tuples sorted by time, where the
+      files of each time step are sorted by the process rank.
+  '''
+
+  steps = {}
+  for tfile in matching_files(fname):
+    info = tracking_file_info(tfile)
+    steps.setdefault(info['time'], []).append((info['rank'], tfile))
+
+  return [ (time, [tfile for rank, tfile in sorted(steps[time])])
+           for time in sorted(steps) ]
+
+
+def merge_rank_arrays(parts, sort_by=None):
+  ''' (array of (array of strings, numpy.ndarray), array of strings)
+      -> array of strings, numpy.ndarray
+      Concatenate the arrays from load_tracking_array for the files of all
+      process ranks of a time step into a single array.
+      If 'sort_by' names coordinate columns, the rows are sorted by them,
+      with the first column as primary key.
+  '''
+  import numpy as np
+
+  header = parts[0][0]
+  for part_header, data in parts:
+    if part_header != header:
+      raise ValueError( 'Differing columns in tracking files of one time step:'
+                        ' {0} and {1}'.format(header, part_header) )
+
+  data = np.concatenate([data for part_header, data in parts])
+  if sort_by:
+    keys = [data[:, header.index(col)] for col in reversed(sort_by)]
+    data = data[np.lexsort(keys)]
+
+  return header, data
+
+
+def tracking_steps(fname, columns=None, nworkers=1, sort_by=None):
+  ''' (string or array of strings, array of strings, integer,
+       array of strings) -> generator of (float, array of strings, numpy.ndarray)
+
+      Read the tracking files matching 'fname', which were written by all
+      process ranks for all time steps, and yield a single array for each
+      time step: (time, header, data), ordered by time.
+      The files of each time step are concatenated in the order of the ranks,
+      or sorted by the coordinate columns given in 'sort_by' (see
+      merge_rank_arrays).
+      'columns' may restrict the read columns, see load_tracking_array.
+
+      With 'nworkers' larger than 1 (or None for all CPUs), the files are
+      read concurrently by a pool of processes, which also reads ahead into
+      the following time steps.
+  '''
+
+  import os
+  from collections import deque
+  from concurrent.futures import ProcessPoolExecutor
+
+  steps = group_tracking_files(fname)
+
+  if nworkers == 1:
+    for time, files in steps:
+      parts = [load_tracking_array(tfile, columns) for tfile in files]
+      yield (time,) + merge_rank_arrays(parts, sort_by)
+    return
+
+  if not nworkers:
+    nworkers = os.cpu_count()
+
+  pending = deque()
+  with ProcessPoolExecutor(max_workers=nworkers) as pool:
+    for time, files in steps:
+      pending.append( (time, [pool.submit(load_tracking_array, tfile, columns)
+                              for tfile in files]) )
+      if sum(len(loading) for t, loading in pending) > 2*nworkers:
+        time, loading = pending.popleft()
+        parts = [part.result() for part in loading]
+        yield (time,) + merge_rank_arrays(parts, sort_by)
+    while pending:
+      time, loading = pending.popleft()
+      parts = [part.result() for part in loading]
+      yield (time,) + merge_rank_arrays(parts, sort_by)
 
 ################################ End tracking ##################################
 
@@ -494,7 +2719,7 @@ def get_paraview_header(filename):
 
   # Find and store the file header line for column names
   colhead = []
-  with open(filename, 'r') as csvfile:
+  with open_text(filename) as csvfile:
     timereader = csv.reader( csvfile, delimiter = ',',
                              skipinitialspace = True  )
     cols = next(timereader)
@@ -510,8 +2735,8 @@ def get_paraview_header(filename):
 
   return colhead
 
-def paraview_append(fname, sqlcon, tabname):
-  ''' (string or array of strings, sqlite3.Connection, string)
+def paraview_append(fname, sqlcon, tabname, nworkers=1):
+  ''' (string or array of strings, sqlite3.Connection, string, integer)
 
       Read paraview csv data from files given in 'fname' and collect them
       in the database connected in 'sqlcon' in the table 'tabname' (which is
@@ -523,12 +2748,14 @@ def paraview_append(fname, sqlcon, tabname):
       as a globbing expression and all files matching the globbing pattern will
       be added to the database.
 
+      'nworkers' is the number of processes to parse files with, see add_to_db.
   '''
 
-  add_to_db(fname, sqlcon, tabname, get_paraview_header, skiprows=2)
+  add_to_db(fname, sqlcon, tabname, get_paraview_header, skiprows=2,
+            nworkers=nworkers)
 
-def paraview_to_db(fname, dbname, tabname):
-  ''' (string or array of strings, string) -> sqlite3.Connection
+def paraview_to_db(fname, dbname, tabname, nworkers=1):
+  ''' (string or array of strings, string, integer) -> sqlite3.Connection
       Read paraview csv data from files given in 'fname', and collect them
       in the database file 'dbname' in the table 'tabname' (which is created if
       it does not yet exist).
@@ -540,11 +2767,14 @@ def paraview_to_db(fname, dbname, tabname):
       be added to the database.
 
       'dbname' is the name of the database file to connect with. See
-      sqlite3.connect for details.
+      connect for details.
       A resulting connector to the database will be returned.
+
+      'nworkers' is the number of processes to parse files with, see add_to_db.
   '''
 
-  return connect_and_add_to_db(fname, dbname, tabname, get_paraview_header, skiprows=2)
+  return connect_and_add_to_db(fname, dbname, tabname, get_paraview_header, skiprows=2,
+                               nworkers=nworkers)
 
 ################################ End paraview ##################################
 
@@ -554,74 +2784,250 @@ def drop_existing(cur, tabname):
   ''' (sqlcursor, string)
       Drop a table in the database, if it already exists.
   '''
-  cur.execute("SELECT count(name) FROM sqlite_master WHERE type='table' AND name='" + tabname + "'")
-  # if the count is 1, then table exists
-  if cur.fetchone()[0] == 1:
+  if table_exists(cur.connection, tabname):
     print('Warning: Table ' + tabname + ' already exists. Dropping table and recreating')
     cur.execute('DROP TABLE ' + tabname)
+    forget_ingested(cur.connection, tabname)
+    forget_indexes(cur.connection, tabname)
+    touch_table(cur.connection, tabname)
+
+def fill_reduced_table(sqlcon, red_tabname, reduced_data, x_key, store=True):
+  ''' (sqlite3.Connection, string, dict of arrays or pandas.DataFrame,
+       string, bool or string) -> dict of np.arrays
 
-def fill_reduced_table(sqlcon, red_tabname, reduced_data, x_key):
-  ''' (sqlite3.Connection, string, dict of arrays, string)
       Fill reduced_data into the table red_tabname of the database connected in
       sqlcon.
       x_key provides the column to take the reduced data about.
       If the table already exists, it is dropped and recreated.
+      All rows are written in bulk with one prepared statement by rows_to_db.
+
+      'reduced_data' may be a dict of arrays or a pandas DataFrame. It is
+      returned as a dict of numpy arrays.
+      With 'store' False the data is not written anywhere and just returned.
+      If 'store' is a filename, the arrays are saved into that .npz file
+      instead of the database.
   '''
+  import numpy as np
+
+  if hasattr(reduced_data, 'to_numpy') and hasattr(reduced_data, 'columns'):
+    reduced_data = { str(col): reduced_data[col].to_numpy()
+                     for col in reduced_data.columns }
+  arrays = { col: np.asarray(vals) for col, vals in reduced_data.items() }
+
+  if store is False or store is None:
+    return arrays
+  if store is not True:
+    np.savez( store, **{ first_word_of(col): arr
+                         for col, arr in arrays.items() } )
+    return arrays
+
   cur = sqlcon.cursor()
 
   drop_existing(cur, red_tabname)
 
-  expand_table( sqlcon, tabname = red_tabname, columns = reduced_data.keys(),
-                        col_to_string = tracking_colstring )
-
-  for row in range(len(reduced_data[x_key])):
-    to_db = []
-    col_titles = []
-    for col in reduced_data.keys():
-      to_db.append(reduced_data[col][row])
-      col_titles.append(first_word_of(col))
-    cur.execute( 'INSERT INTO {0} ({1}) VALUES ({2});'.format(
-                     red_tabname,
-                     ', '.join(col_titles),
-                     ', '.join('?'*len(col_titles)) ),
-                 to_db )
-  sqlcon.commit()
+  nrows = len(arrays[x_key])
+  if all(arr.dtype.kind in 'biuf' for arr in arrays.values()):
+    rows = np.column_stack([ arr[:nrows].astype(float)
+                             for arr in arrays.values() ])
+  else:
+    rows = zip(*[ arr[:nrows].tolist() for arr in arrays.values() ])
+  rows_to_db( sqlcon, rows, list(arrays.keys()), red_tabname,
+              col_to_string = tracking_colstring )
+  return arrays
+
+
+def chunked_statistics(keyed_chunks):
+  ''' (iterable of (np.array, np.array))
+      -> (np.array, np.array, np.array, np.array)
+
+      Compute statistics of values over identical keys across a stream of
+      chunks. Each chunk is a pair of a 1-D array of keys and a 2-D array with
+      one row of values per key.
+      Returned are the distinct keys in the order of their first occurrence,
+      the number of values for each key, and 2-D arrays with the mean and the
+      sum of squared deviations from the mean for each key and value column.
+      The variance is obtained by dividing the latter by the count.
+      Each chunk is reduced by a single grouping of its keys, the partial
+      results of several chunks are merged in the same way.
+  '''
+  import numpy as np
+
+  def grouped(keys):
+    # Group ids numbered in the order of the first occurrence of the keys.
+    uniq, first, inverse = np.unique( keys, return_index=True,
+                                      return_inverse=True )
+    order = np.argsort(first, kind='stable')
+    rank = np.empty_like(order)
+    rank[order] = np.arange(len(order))
+    return (uniq[order], rank[inverse.reshape(-1)])
+
+  def groupsum(gid, weights, ngroups):
+    return np.column_stack([ np.bincount(gid, weights=weights[:, i],
+                                         minlength=ngroups)
+                             for i in range(weights.shape[1]) ])
+
+  parts = []
+  nvals = 0
+  for keys, vals in keyed_chunks:
+    nvals = vals.shape[1]
+    if len(keys) == 0:
+      continue
+    uniq, gid = grouped(keys)
+    counts = np.bincount(gid, minlength=len(uniq))
+    means = groupsum(gid, vals, len(uniq)) / counts[:, None]
+    m2 = groupsum(gid, (vals - means[gid])**2, len(uniq))
+    parts.append((uniq, counts, means, m2))
+
+  if not parts:
+    return ( np.array([]), np.zeros(0, dtype=int), np.zeros((0, nvals)),
+             np.zeros((0, nvals)) )
+  if len(parts) == 1:
+    return parts[0]
+
+  keys, counts, means, m2 = [ np.concatenate(part) for part in zip(*parts) ]
+  uniq, gid = grouped(keys)
+  total = np.bincount(gid, weights=counts, minlength=len(uniq))
+  totmeans = groupsum(gid, counts[:, None] * means, len(uniq)) / total[:, None]
+  totm2 = ( groupsum(gid, m2, len(uniq))
+            + groupsum(gid, counts[:, None] * (means - totmeans[gid])**2,
+                       len(uniq)) )
+  return (uniq, total.astype(int), totmeans, totm2)
+
+
+def chunked_means(keyed_chunks):
+  ''' (iterable of (np.array, np.array)) -> (np.array, np.array)
+
+      Average values over identical keys across a stream of chunks, see
+      chunked_statistics.
+      Returned are the distinct keys in the order of their first occurrence
+      and a 2-D array with the mean values for each of them.
+  '''
+  keys, counts, means, m2 = chunked_statistics(keyed_chunks)
+  return (keys, means)
+
 
-def spatial_reduction_in_db(sqlcon, tabname, columns, reduce_coord_column):
-  ''' (sqlite3.Connection, string, array of strings, string)
+# Tables with more rows are reduced inside SQLite by spatial_reduction_in_db.
+SQL_REDUCTION_ROWS = 2000000
+
+def binned_coordinate(coord, resolution):
+  ''' (string, float) -> string
+      SQL expression for the center of the bin of width 'resolution' that the
+      column 'coord' falls into. The same bins are computed by
+      (np.floor(coord / resolution) + 0.5) * resolution.
+  '''
+  scaled = '({0}) / {1!r}'.format(coord, float(resolution))
+  return ( '((CAST({0} AS INTEGER) - ({0} < CAST({0} AS INTEGER)) + 0.5)'
+           ' * {1!r})'.format(scaled, float(resolution)) )
+
+
+def spatial_reduction_in_db(sqlcon, tabname, columns, reduce_coord_column,
+                            chunksize=None, resolution=None, engine=None,
+                            store=True, index=False):
+  ''' (sqlite3.Connection, string, array of strings, string, int, float,
+       string, bool or string, bool) -> dict of np.arrays
 
       Reduce columns with respect to reduce_coord_column
 
       Read data with 'columns' from 'sqlcon' under the table 'tabname' and
       reduce those columns along 'reduction_coord'. Reduced columns are written
       into 'sqlcon' under the table 'tabname'_red.
+
+      All columns are averaged together for each distinct value of
+      'reduce_coord_column', the reduced coordinate itself keeps its exact
+      value. With a 'resolution' the coordinate is binned into intervals of
+      that width instead, and each bin is represented by its center (see
+      binned_coordinate). The reduced rows are ordered by the first
+      occurrence of their coordinate.
+
+      The reduction is done by the given 'engine':
+      'numpy' loads all columns with a single query and groups them with
+      numpy (see chunked_statistics). With a 'chunksize' the table is
+      streamed in chunks of that many rows (see column_chunks) instead of
+      being loaded completely into memory.
+      'sql' runs the reduction as a single INSERT ... SELECT with GROUP BY
+      inside SQLite, so no data is loaded into Python at all.
+      By default 'sql' is used for tables with more than SQL_REDUCTION_ROWS
+      rows and 'numpy' otherwise.
+
+      The reduced columns are returned as numpy arrays. With 'store' other
+      than True they are not written into the database, but only returned or
+      saved into a file, see fill_reduced_table.
+
+      With 'index' an index on 'reduce_coord_column' is maintained, see
+      ensure_index.
   '''
+  if index:
+    ensure_index(sqlcon, tabname, [reduce_coord_column])
+  if engine is None:
+    if max_rowid(sqlcon, tabname) > SQL_REDUCTION_ROWS:
+      engine = 'sql'
+    else:
+      engine = 'numpy'
+
+  if engine == 'sql':
+    red_tabname = tabname + "_red"
+    key = reduce_coord_column
+    if resolution:
+      key = binned_coordinate(reduce_coord_column, resolution)
+    selected = [ key if col == reduce_coord_column else 'avg({0})'.format(col)
+                 for col in columns ]
+    if store is not True:
+      res = fetch_columns( sqlcon,
+                           'SELECT {0} FROM {1} GROUP BY {2} ORDER BY min(rowid)'
+                           .format(', '.join(selected), tabname, key),
+                           columns, as_nparray=True )
+      return fill_reduced_table( sqlcon, red_tabname, dict(zip(columns, res)),
+                                 reduce_coord_column, store=store )
+    drop_existing(sqlcon.cursor(), red_tabname)
+    expand_table( sqlcon, tabname = red_tabname, columns = columns,
+                  col_to_string = tracking_colstring )
+    sqlcon.execute( 'INSERT INTO {0} ({1}) SELECT {2} FROM {3}'
+                    ' GROUP BY {4} ORDER BY min(rowid)'.format(
+                        red_tabname,
+                        ', '.join(first_word_of(col) for col in columns),
+                        ', '.join(selected), tabname, key ) )
+    sqlcon.commit()
+    titles = [first_word_of(col) for col in columns]
+    res = fetch_columns( sqlcon, 'SELECT {0} FROM {1}'.format(', '.join(titles),
+                                                             red_tabname),
+                         titles, as_nparray=True )
+    return dict(zip(columns, res))
+
+  if engine != 'numpy':
+    raise ValueError('Unknown reduction engine ' + str(engine))
+
   import numpy as np
-  coord_val_red = get_columns(sqlcon, tabname, columns=[reduce_coord_column])
-  col_val_red = dict()
 
-  for col in columns:
-    val = get_columns(sqlcon, tabname, columns=[col])
-    val_dict = dict()
-    for ii in range(len(coord_val_red)):
-      key = str(coord_val_red[ii])
-      if key in val_dict:
-        val_dict[key].append(val[ii])
-      else:
-        val_dict[key] = [val[ii]]
+  cols = [reduce_coord_column] + list(columns)
+  if chunksize:
+    chunks = column_chunks(sqlcon, tabname, cols, chunksize=chunksize)
+  else:
+    chunks = [ Table(sqlcon, tabname, cols).to_numpy().astype(float) ]
+
+  def keyed(chunk):
+    coord = chunk[:, 0]
+    if resolution:
+      coord = (np.floor(coord / resolution) + 0.5) * resolution
+    return (coord, chunk[:, 1:])
 
-    col_val_red[col] = np.array([])
-    for key in val_dict:
-       col_val_red[col] = np.append(col_val_red[col],
-                                    np.average(np.array(val_dict[key])))
+  keys, means = chunked_means(keyed(chunk) for chunk in chunks)
 
-  fill_reduced_table(sqlcon, tabname + "_red", col_val_red, reduce_coord_column)
+  col_val_red = dict()
+  for i, col in enumerate(columns):
+    if col == reduce_coord_column:
+      col_val_red[col] = keys
+    else:
+      col_val_red[col] = means[:, i]
+  return fill_reduced_table(sqlcon, tabname + "_red", col_val_red,
+                            reduce_coord_column, store=store)
 
 
 def radial_reduction_in_db(sqlcon, tabname, columns, coord_column,
-                           geometry_pos):
+                           geometry_pos, chunksize=None, resolution=None,
+                           store=True, index=None):
   ''' (sqlite3.Connection, string, array of strings, array of strings,
-       list of floats)
+       list of floats, int, float, bool or string, bool)
+      -> dict of np.arrays
       Average columns along the radial direction (around the z axis) to
       plot data over angle.
 
@@ -631,76 +3037,293 @@ def radial_reduction_in_db(sqlcon, tabname, columns, coord_column,
                      coordX[ii][0] - geometry_pos[0])*180/math.pi
       Reduced columns and theta are written into 'sqlcon' under the table
       'tabname'_red.
+
+      Without a 'resolution' all points with exactly the same angle are
+      averaged. The angles are then computed by math.atan2 point by point,
+      as the vectorized numpy.arctan2 may differ from it in the last bit and
+      thereby split or merge groups of points.
+      With a 'resolution' in degrees, the angles are mapped to [0, 360) and
+      binned into intervals of that width, then all points within a bin are
+      averaged and theta is set to the bin center.
+      Along with the mean of each column, the reduced table holds the mean
+      'radius' of the points from geometry_pos, the 'count' of points, and
+      the standard deviation of each column in '<column>_std'. Columns that
+      would collide with these names are rejected with a ValueError.
+      Theta and radius are computed once for all points and all columns are
+      reduced together, see chunked_statistics.
+
+      With a 'chunksize' the table is streamed in chunks of that many rows
+      (see column_chunks) instead of being loaded completely into memory.
+
+      The reduced columns are returned as numpy arrays. With 'store' other
+      than True they are not written into the database, but only returned or
+      saved into a file, see fill_reduced_table.
+
+      An index on the 'coord_column' is maintained for large tables, or as
+      selected by 'index', see auto_index.
   '''
-  import numpy as np
   import math
-  [coordX, coordY] = get_columns(sqlcon, tabname, columns=coord_column)
-  theta_red = np.array([])
+  import numpy as np
+
+  valcols = [col for col in columns if col not in coord_column]
+  titles = [first_word_of(col) for col in valcols]
+  reserved = {'theta', 'radius', 'count'}.union(t + '_std' for t in titles)
+  clashes = [title for title in titles if title in reserved]
+  if clashes:
+    raise ValueError( 'Columns clash with the names of reduced columns: '
+                      + ', '.join(clashes) )
+
+  auto_index(sqlcon, tabname, coord_column, index)
+  cols = list(coord_column) + valcols
+  if chunksize:
+    chunks = column_chunks(sqlcon, tabname, cols, chunksize=chunksize)
+  else:
+    chunks = [ Table(sqlcon, tabname, cols).to_numpy().astype(float) ]
+
+  def angles(chunk):
+    dx = chunk[:, 0] - geometry_pos[0]
+    dy = chunk[:, 1] - geometry_pos[1]
+    if resolution:
+      theta = 180 - np.arctan2(dy, dx) * 180 / np.pi
+      theta = (np.floor(np.mod(theta, 360) / resolution) + 0.5) * resolution
+    else:
+      theta = np.fromiter( map(math.atan2, dy.tolist(), dx.tolist()),
+                           dtype=float, count=len(dx) )
+      theta = 180 - theta * 180 / math.pi
+    return (theta, np.column_stack([np.hypot(dx, dy), chunk[:, 2:]]))
+
+  keys, counts, means, m2 = chunked_statistics(angles(chunk)
+                                               for chunk in chunks)
+  std = np.sqrt(m2 / np.maximum(counts, 1)[:, None])
+
   col_val_red = dict()
-  for col in columns:
-    if col not in coord_column:
-      val = get_columns(sqlcon, tabname, columns=[col])
-      val_dict = dict()
-      for ii in range(len(coordX)):
-        key = 180 - math.atan2(coordY[ii] - geometry_pos[1],
-                               coordX[ii] - geometry_pos[0]) * 180 / math.pi
-        if key in val_dict:
-          val_dict[key].append(val[ii])
-        else:
-          val_dict[key] = [val[ii]]
-          if col == columns[0]:
-            theta_red = np.append(theta_red, key)
+  for i, col in enumerate(valcols):
+    col_val_red[col] = means[:, i+1]
+  col_val_red['theta'] = keys
+  col_val_red['radius'] = means[:, 0]
+  col_val_red['count'] = counts
+  for i, col in enumerate(valcols):
+    col_val_red[first_word_of(col) + '_std'] = std[:, i+1]
+  return fill_reduced_table(sqlcon, tabname + '_red', col_val_red, 'theta',
+                            store=store)
+
+
+def bin_edges(sqlcon, tabname, coord_columns, bins, where='', params=()):
+  ''' (sqlite3.Connection, string, array of strings, integer or array or
+       array of those, string, tuple) -> array of np.arrays
+
+      Get the bin edges for each of the 'coord_columns' from 'bins'.
+      'bins' is given for each coordinate as either the number of equally
+      sized bins spanning the range of the coordinate in the table 'tabname'
+      (for the rows meeting 'where'), or as an array of monotonically
+      increasing edges.
+      A single number or a flat array of edges is used for all coordinates.
+      A sequence that contains arrays provides the bins for each coordinate,
+      just like a flat sequence of integers with one entry per coordinate,
+      which gives the number of bins for each of them. Thus, edges for all
+      coordinates, that happen to be as many integers as there are
+      coordinates, have to be given as floats.
+  '''
+  import numpy as np
 
-      col_val_red[col] = np.array([])
-      for key in val_dict:
-         col_val_red[col] = np.append(col_val_red[col],
-                                      np.average(np.array(val_dict[key])))
+  if not hasattr(bins, '__len__'):
+    bins = [bins] * len(coord_columns)
+  elif any(np.ndim(colbins) > 0 for colbins in bins):
+    if len(bins) != len(coord_columns):
+      raise ValueError( 'Got bins for {0} coordinates, but {1} coordinate'
+                        ' columns'.format(len(bins), len(coord_columns)) )
+  elif not ( len(bins) == len(coord_columns)
+             and np.asarray(bins).dtype.kind in 'iu' ):
+    bins = [bins] * len(coord_columns)
+
+  edges = []
+  for col, colbins in zip(coord_columns, bins):
+    if np.ndim(colbins) == 0:
+      selquery = 'SELECT min({0}), max({0}) FROM {1}'.format(col, tabname)
+      if where:
+        selquery += ' WHERE {0}'.format(where)
+      low, high = sqlcon.execute(selquery, params).fetchone()
+      if low is None:
+        low, high = 0.0, 1.0
+      edges.append(np.linspace(low, high, int(colbins) + 1))
+    else:
+      edges.append(np.asarray(colbins, dtype=float))
+  return edges
+
+
+def binned_statistics(sqlcon, tabname, coord_columns, bins, value_columns,
+                      chunksize=STREAM_CHUNKSIZE, where='', params=()):
+  ''' (sqlite3.Connection, string, array of strings, integer or array or
+       array of those, array of strings, integer, string, tuple)
+      -> (array of np.arrays, dict of np.arrays)
+
+      Compute statistics of the 'value_columns' on a grid of bins over the
+      'coord_columns' of the table 'tabname', for example the mean velocity on
+      an (x, y) grid. The bins are given by 'bins', see bin_edges. Like in
+      numpy.histogramdd the last bin in each direction includes its upper
+      edge, points outside of the bins are ignored.
+
+      The table is streamed in chunks of 'chunksize' rows (see column_chunks),
+      optionally restricted to the rows meeting 'where' with 'params'. The
+      statistics of all chunks are merged, so only one chunk and the grid of
+      statistics need to fit into memory.
+
+      Returned are the bin edges for each coordinate and a dict with arrays
+      of the grid shape: the 'count' of points in each bin and, for each
+      value column, its mean in '<column>', and '<column>_min',
+      '<column>_max' and '<column>_var' (the population variance). Empty
+      bins hold NaN.
+  '''
+  import numpy as np
+
+  edges = bin_edges(sqlcon, tabname, coord_columns, bins, where, params)
+  shape = tuple(len(edge) - 1 for edge in edges)
+  nbins = int(np.prod(shape))
+  nvals = len(value_columns)
+  ndim = len(coord_columns)
+
+  count = np.zeros(nbins)
+  mean = np.zeros((nbins, nvals))
+  m2 = np.zeros((nbins, nvals))
+  vmin = np.full((nbins, nvals), np.inf)
+  vmax = np.full((nbins, nvals), -np.inf)
+
+  for chunk in column_chunks( sqlcon, tabname,
+                              list(coord_columns) + list(value_columns),
+                              chunksize=chunksize, where=where,
+                              params=params ):
+    inside = np.ones(len(chunk), dtype=bool)
+    index = []
+    for i, edge in enumerate(edges):
+      coord = chunk[:, i]
+      ibin = np.searchsorted(edge, coord, side='right') - 1
+      ibin[coord == edge[-1]] = len(edge) - 2
+      inside &= (ibin >= 0) & (ibin < len(edge) - 1)
+      index.append(ibin)
+    flat = np.ravel_multi_index([ibin[inside] for ibin in index], shape)
+    vals = chunk[inside][:, ndim:]
+
+    ncount = np.bincount(flat, minlength=nbins).astype(float)
+    filled = ncount > 0
+    nmean = np.zeros((nbins, nvals))
+    nm2 = np.zeros((nbins, nvals))
+    for j in range(nvals):
+      nmean[filled, j] = ( np.bincount(flat, weights=vals[:, j],
+                                       minlength=nbins)[filled]
+                           / ncount[filled] )
+      nm2[:, j] = np.bincount( flat, weights=(vals[:, j] - nmean[flat, j])**2,
+                               minlength=nbins )
+      np.minimum.at(vmin[:, j], flat, vals[:, j])
+      np.maximum.at(vmax[:, j], flat, vals[:, j])
+
+    # Merge the chunk into the statistics so far (Chan et al.).
+    total = count + ncount
+    weight = np.divide(ncount, total, out=np.zeros(nbins), where=total > 0)
+    delta = nmean - mean
+    mean += delta * weight[:, None]
+    m2 += nm2 + delta**2 * (count * weight)[:, None]
+    count = total
+
+  empty = count == 0
+  res = {'count': count.astype(int).reshape(shape)}
+  for j, col in enumerate(value_columns):
+    name = first_word_of(col)
+    for key, stat in ( (name, mean[:, j]),
+                       (name + '_min', vmin[:, j]),
+                       (name + '_max', vmax[:, j]),
+                       (name + '_var', np.divide( m2[:, j], count,
+                                                  out=np.zeros(nbins),
+                                                  where=~empty )) ):
+      stat = stat.copy()
+      stat[empty] = np.nan
+      res[key] = stat.reshape(shape)
+  return (edges, res)
+
+
+def binned_reduction_in_db(sqlcon, tabname, coord_columns, bins,
+                           value_columns, chunksize=STREAM_CHUNKSIZE,
+                           where='', params=(), store=True):
+  ''' (sqlite3.Connection, string, array of strings, integer or array or
+       array of those, array of strings, integer, string, tuple,
+       bool or string) -> dict of np.arrays
+
+      Reduce the 'value_columns' of table 'tabname' onto a grid of bins over
+      the 'coord_columns', see binned_statistics for the arguments.
+      The non-empty bins are written into the table 'tabname'_red with one
+      row per bin. It holds the bin center in each of the 'coord_columns',
+      the 'count' of points and the statistics of each value column.
+      The rows are returned as numpy arrays, for 'store' see
+      fill_reduced_table.
+  '''
+  import numpy as np
 
-  col_val_red['theta'] = theta_red
-  fill_reduced_table(sqlcon, tabname + '_red', col_val_red, 'theta')
+  edges, stats = binned_statistics( sqlcon, tabname, coord_columns, bins,
+                                    value_columns, chunksize=chunksize,
+                                    where=where, params=params )
+  filled = stats['count'] > 0
+  centers = np.meshgrid( *[ 0.5 * (edge[1:] + edge[:-1]) for edge in edges ],
+                         indexing='ij' )
+
+  reduced = dict()
+  for col, center in zip(coord_columns, centers):
+    reduced[col] = center[filled]
+  for key, stat in stats.items():
+    reduced[key] = stat[filled]
+  return fill_reduced_table( sqlcon, tabname + '_red', reduced,
+                             coord_columns[0], store=store )
 
 
 ## Routine : Find distinct sets from database
-def distinct_sets(sqlcon, tabname, signature, constraint=''):
+def distinct_sets(sqlcon, tabname, signature, constraint='', params=(),
+                  index=None):
 
-  """ (sqlite3.Connector, string, array of strings, string) -> array of dicts
+  """ (sqlite3.Connector, string, array of strings, string, tuple, bool)
+      -> array of dicts
 
       Find distinct entries in the database connected by <sqlcon>, matching the
       given <signature> under the <constraint> in table <tabname>.
       The string in <constraint> has to be a valid SQL WHERE clause or empty.
+      It may contain '?' placeholders, which are bound to <params>.
       As a result all unique combinations of the <signature> from the database
       are returned in a dictionary with the <signature> strings as keys.
+
+      All combinations are found with a single grouped query. They are ordered
+      by the first occurrence of the last signature column, then within that
+      by the first occurrence of the one before it and so on.
+      A covering index on the <signature> columns speeds up the query and the
+      lookup of the sets. By default it is created for tables with at least
+      INDEX_MIN_ROWS rows, with <index> True it is always created and with
+      False never, see auto_index.
   """
 
   sig = list(signature)
-  col = sig.pop()
-
-  if constraint == '':
-    conjunc = ' WHERE '
-  else:
-    conjunc = ' AND '
-
-  selquery = 'SELECT DISTINCT ' + col + ' FROM ' + tabname + constraint
+  auto_index(sqlcon, tabname, sig, index)
+
+  selquery = 'SELECT {0} FROM {1}{2} GROUP BY {0} ORDER BY min(rowid)'.format(
+                 ', '.join(sig), tabname, constraint )
+  combos = sqlcon.execute(selquery, params).fetchall()
+
+  # Rank each combination by the first occurrence of its prefixes, starting
+  # with the last signature column.
+  first_seen = dict()
+  ranks = []
+  for combo in combos:
+    rank = []
+    for i in range(len(sig)-1, -1, -1):
+      prefix = combo[i:]
+      rank.append(first_seen.setdefault(prefix, len(first_seen)))
+    ranks.append(rank)
 
   res = []
-  if len(sig) == 0:
-    for val in sqlcon.execute(selquery):
-      res.append({col: val[0]})
-  else:
-    precons = constraint + conjunc + col + "='"
-    for val in sqlcon.execute(selquery):
-      childconstraint = "{0}{1}'".format(precons, val[0])
-      childs = distinct_sets(sqlcon, tabname, sig, constraint = childconstraint)
-
-      for child in childs:
-        child[col] = val[0]
-        res.append(child)
+  for rank, combo in sorted(zip(ranks, combos), key=lambda rc: rc[0]):
+    res.append(dict(zip(sig, combo)))
 
   return res
 
 
 ## Routine : Creates x-y data in accordance with keys of <selections> and the
 ##           type of <reduction> method
+@memoized
 def collected_xy_series(sqlcon, tabname, selections, x, y, reduction="median"):
 
   """ (sqlite3.Connector, string, list of dicts, string, list of strings,
@@ -736,19 +3359,151 @@ def collected_xy_series(sqlcon, tabname, selections, x, y, reduction="median"):
   return (res, ID_tuple)
 
 
+def bound_value(val):
+  """ (object) -> object
+
+      Turn a selected value into a parameter for a prepared statement.
+      Numbers, including numpy scalars, are bound as numbers, so they are
+      compared numerically, everything else as it is.
+  """
+  import numbers
+
+  if isinstance(val, numbers.Integral):
+    return int(val)
+  if isinstance(val, numbers.Real):
+    return float(val)
+  return val
+
+
+def matching_params(val):
+  """ (object) -> tuple
+
+      Parameters to select rows, where a column equals the value <val>, by
+      the condition 'column IN (?, ?)'.
+      Numbers are bound as text, like in a quoted query, and as numbers. In
+      columns with a declared numeric or text type SQLite converts either of
+      them according to the column affinity. Columns without a declared type
+      do no conversion, there the text matches values stored as text, as
+      they are by file_to_db, and the number matches values stored as
+      numbers.
+  """
+  val = bound_value(val)
+  if isinstance(val, (int, float)):
+    return (str(val), val)
+  return (val, val)
+
+
+@lru_cache(maxsize=128)
+def selection_query(tabname, col, names):
+  """ (string, string, tuple of strings) -> string
+
+      SELECT statement for <col> from table <tabname> for rows where the
+      columns <names> match bound parameters, two per name as given by
+      matching_params.
+      The statements are built once and reused, so SQLite finds them in the
+      statement cache of the connection.
+  """
+  return 'SELECT {0} FROM {1} WHERE {2}'.format(
+             col, tabname, ' AND '.join('{0} IN (?, ?)'.format(name)
+                                         for name in names) )
+
+
+# Reductions known by grouped_reduction.
+REDUCTIONS = ('median', 'min', 'max', 'mean')
+
+def grouped_reduction(sqlcon, tabname, selections, cols,
+                      reductions=REDUCTIONS, index=None):
+  """ (sqlite3.Connector, string, list of dicts, list of strings,
+       array of strings, bool) -> dict of np.arrays
+
+      Reduce the data in <cols> from table <tabname> in the database connected
+      by <sqlcon> for all <selections> at once.
+      The <selections> are written into a temporary table and joined with
+      <tabname>, so all matching rows are fetched with a single query per set
+      of selection keys. A row matches a selection, if each of its key
+      columns equals the selected value, just like in number_set, see
+      matching_params. An index on the key columns is maintained for large
+      tables, or as selected by <index>, see auto_index.
+      Returned is a dict with an array of shape (selections, cols) for each of
+      the requested <reductions> out of REDUCTIONS. Selections without any
+      matching rows result in NaN.
+  """
+  import numpy as np
+
+  res = { red: np.full((len(selections), len(cols)), np.nan)
+          for red in reductions }
+
+  bykeys = dict()
+  for isel, sel in enumerate(selections):
+    bykeys.setdefault(tuple(sel.keys()), []).append(isel)
+
+  for keys, members in bykeys.items():
+    auto_index(sqlcon, tabname, list(keys), index)
+    selcols = [ ('gleaner_t{0}'.format(i), 'gleaner_n{0}'.format(i))
+                for i in range(len(keys)) ]
+    started = not sqlcon.in_transaction
+    sqlcon.execute( 'CREATE TEMP TABLE gleaner_selections (gleaner_idx, {0})'
+                    .format(', '.join(', '.join(pair) for pair in selcols)) )
+    joincond = ' AND '.join( 't.{0} IN (s.{1}, s.{2})'.format(key, *pair)
+                             for key, pair in zip(keys, selcols) )
+    selquery = ( 'SELECT s.gleaner_idx, {0} FROM gleaner_selections AS s'
+                 ' JOIN {1} AS t ON {2}' ).format(', '.join(cols), tabname,
+                                                  joincond)
+    try:
+      sqlcon.executemany( 'INSERT INTO gleaner_selections VALUES ({0})'
+                          .format(', '.join('?'*(2*len(keys)+1))),
+                          [ [isel] + [ param for key in keys
+                                       for param in matching_params(
+                                                    selections[isel][key]) ]
+                            for isel in members ] )
+      data = fetch_columns( sqlcon, selquery, ['gleaner_idx'] + list(cols),
+                            as_nparray='2d' ).astype(float)
+    finally:
+      sqlcon.execute('DROP TABLE temp.gleaner_selections')
+      if started:
+        sqlcon.commit()
+
+    idx = data[:, 0].astype(int)
+    counts = np.bincount(idx, minlength=len(selections))
+    found = counts > 0
+    starts = np.cumsum(counts) - counts
+    for j in range(len(cols)):
+      vals = data[:, j+1]
+      order = np.lexsort((vals, idx))
+      svals = vals[order]
+      for red in reductions:
+        if red == 'median':
+          lower = svals[(starts + (counts-1)//2)[found]]
+          upper = svals[(starts + counts//2)[found]]
+          res[red][found, j] = 0.5 * (upper + lower)
+        elif red == 'min':
+          res[red][found, j] = svals[starts[found]]
+        elif red == 'max':
+          res[red][found, j] = svals[(starts + counts - 1)[found]]
+        elif red == 'mean':
+          sums = np.bincount(idx[order], weights=svals,
+                             minlength=len(selections))
+          res[red][found, j] = sums[found] / counts[found]
+        else:
+          raise ValueError('Unknown reduction ' + str(red))
+
+  return res
+
+
 ##Routine : Obtaining 'ydat'
 def data_for_sets(sqlcon, tabname, selections, cols, reduction="median"):
   """ (sqlite3.Connector, string, list of dicts, list of strings, string) -> list of lists
 
       Look up the reduced data in <cols> from the database in "sqlcon" for all
       <selections> using the <reduction> operation out of table <tabname>.
+      All selections are reduced together by grouped_reduction.
   """
 
-  res = []
-  for sel in selections:
-    res.append(reduced_set(sqlcon, tabname, sel, cols, reduction))
+  if reduction not in REDUCTIONS:
+    return [[] for sel in selections]
+  res = grouped_reduction(sqlcon, tabname, selections, cols, [reduction])
 
-  return(res)
+  return(res[reduction].tolist())
 
 
 ##Routine : Obtaining a single value according to the <reduction> type
@@ -761,18 +3516,7 @@ def reduced_set(sqlcon, tabname, selection, cols, reduction="median"):
       entries of <selection> in table <tabname>.
   """
 
-  res = []
-  for col in cols:
-    vals = number_set(sqlcon, tabname, selection, col)
-    if reduction == 'median':
-      res.append(median(vals))
-    elif reduction == 'min':
-      res.append(vals[0])
-    elif reduction == 'max':
-      res.append(vals[-1])
-    elif reduction == 'mean':
-      res.append(float(sum(vals))/float(len(vals)))
-  return(res)
+  return(data_for_sets(sqlcon, tabname, [selection], cols, reduction)[0])
 
 
 ## Routine : Sorting of entries in <col> from database
@@ -783,14 +3527,15 @@ def number_set(sqlcon, tabname, selection, col):
       given by <selection> in table <tabname>.
       The result will be the numerically sorted values from <col> in the
       database and is supposed to be numbers.
+      The selected values are bound to a prepared statement, see
+      selection_query and matching_params.
   """
 
-  constraints = []
-  for (name, val) in selection.items():
-    constraints.append("{0}='{1}'".format(name, val))
-  selquery = 'SELECT ' + col + ' FROM ' + tabname + ' WHERE ' + ' AND '.join(constraints)
+  names = tuple(selection.keys())
+  selquery = selection_query(tabname, col, names)
   cur = sqlcon.cursor()
-  cur.execute(selquery)
+  cur.execute(selquery, [ param for name in names
+                          for param in matching_params(selection[name]) ])
   res_str = cur.fetchall()
   res = []
   for strval in res_str:
@@ -877,10 +3622,11 @@ def xy_series_value_at(series, x):
 
 ############################### SCALING PLOTS ##################################
 
+@memoized
 def perfmap_series(sqlcon, tabname, signature, xcol, ycol, reduction = 'median',
-                   constraint = '', nProcsCol = 'nProcs'):
+                   constraint = '', nProcsCol = 'nProcs', index = None):
   """ (sqlite3.Connector, string, array of strings, string, string, string,
-       string, string) -> dict of arrays
+       string, string, bool) -> dict of arrays
 
       Get all performance map series from the database in <sqlcon>.
       Individual runs are identified by <signature> and the x-axis is
@@ -892,6 +3638,8 @@ def perfmap_series(sqlcon, tabname, signature, xcol, ycol, reduction = 'median',
       If there are multiple entries for the same run, <reduction> is used to
       obtain a single value out of them (defaults to the median).
       Data to select from the database can be restricted by <constraint>.
+      A covering index on the <signature> columns is maintained for large
+      tables, or as selected by <index>, see distinct_sets.
 
       The resulting data is identified by the nProcs and further identifying
       parts from the signature, and an array of x,y tuples:
@@ -917,7 +3665,7 @@ def perfmap_series(sqlcon, tabname, signature, xcol, ycol, reduction = 'median',
     logging.error('In perfmap_series : List ycol is empty ')
 
   else:
-    runs = distinct_sets(sqlcon, tabname, signature)
+    runs = distinct_sets(sqlcon, tabname, signature, index=index)
     perf, FullID = collected_xy_series(sqlcon, tabname, runs, xcol,
                                                      [ycol], reduction)
     id_keys = [key for key in FullID._fields if key != nProcsCol]